@@ -0,0 +1,153 @@
+"""Keeps compiled code of string-loaded modules on disk between restarts"""
+
+# ©️ Codrago, 2024-2030
+# This file is a part of Heroku Userbot
+# 🌐 https://github.com/coddrago/Heroku
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import _imp
+import contextlib
+import importlib.util
+import logging
+import marshal
+import os
+import tempfile
+import types
+import typing
+
+logger = logging.getLogger(__name__)
+
+MAX_TOTALSIZE = 1024 * 1024 * 64  # 64 MB
+# Entries compiled by another interpreter version must never be loaded
+MAGIC = importlib.util.MAGIC_NUMBER.hex()
+
+
+class BytecodeCache:
+    """
+    Marshal-based cache of module code objects, keyed by SHA-256 of source.
+    When the cache grows over `max_size`, least recently used entries are removed
+    """
+
+    def __init__(self, max_size: int = MAX_TOTALSIZE):
+        self._path = os.path.join(os.path.expanduser("~"), ".heroku", "bytecode_cache")
+        self._max_size = max_size
+        self._size: typing.Optional[int] = None
+        self._ensure_dirs()
+
+    def _ensure_dirs(self):
+        """Ensures that the cache directory exists."""
+        with contextlib.suppress(OSError):
+            os.makedirs(self._path, exist_ok=True)
+
+    def _get_path(self, source_hash: str) -> str:
+        return os.path.join(self._path, f"{source_hash}.{MAGIC}.bin")
+
+    @property
+    def _total_size(self) -> int:
+        if self._size is None:
+            with contextlib.suppress(OSError):
+                self._size = sum(
+                    entry.stat().st_size
+                    for entry in os.scandir(self._path)
+                    if entry.is_file()
+                )
+
+        return self._size or 0
+
+    def load(self, source_hash: str, origin: str) -> typing.Optional[types.CodeType]:
+        """
+        Loads code object from cache.
+        :param source_hash: SHA-256 of module source.
+        :param origin: Filename, which code object should report.
+        :return: Code object or None.
+        """
+        path = self._get_path(source_hash)
+        try:
+            with open(path, "rb") as f:
+                code = marshal.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.debug("Dropping broken bytecode cache entry %s", path, exc_info=True)
+            self._remove(path)
+            return None
+
+        if not isinstance(code, types.CodeType):
+            self._remove(path)
+            return None
+
+        with contextlib.suppress(OSError):
+            os.utime(path)
+
+        # Same source may come from another origin, so filenames in tracebacks
+        # are updated the same way importlib does it for moved `.pyc` files
+        _imp._fix_co_filename(code, origin)
+        return code
+
+    def save(self, source_hash: str, code: types.CodeType):
+        """
+        Saves code object to cache.
+        :param source_hash: SHA-256 of module source.
+        :param code: Compiled module code.
+        """
+        try:
+            data = marshal.dumps(code)
+        except ValueError:
+            logger.debug("Can't marshal code of %s", code.co_filename, exc_info=True)
+            return
+
+        if len(data) > self._max_size:
+            return
+
+        self._evict(self._max_size - len(data))
+
+        path = self._get_path(source_hash)
+        replaced = 0
+        with contextlib.suppress(OSError):
+            replaced = os.path.getsize(path)
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self._path, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+
+            os.replace(tmp, path)
+        except OSError:
+            logger.debug("Can't save bytecode cache entry %s", path, exc_info=True)
+            with contextlib.suppress(NameError, OSError):
+                os.remove(tmp)
+
+            return
+
+        self._size = self._total_size + len(data) - replaced
+
+    def _remove(self, path: str):
+        with contextlib.suppress(OSError):
+            size = os.path.getsize(path)
+            os.remove(path)
+            if self._size is not None:
+                self._size -= size
+
+    def _evict(self, target: int):
+        """Removes least recently used entries until cache fits into `target`"""
+        if self._total_size <= target:
+            return
+
+        try:
+            entries = sorted(
+                (entry.stat().st_mtime, entry.path)
+                for entry in os.scandir(self._path)
+                if entry.is_file()
+            )
+        except OSError:
+            return
+
+        for _, path in entries:
+            if self._total_size <= target:
+                break
+
+            self._remove(path)
+
+
+bytecode_cache = BytecodeCache()
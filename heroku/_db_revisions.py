@@ -0,0 +1,191 @@
+"""Bounded history of database states"""
+
+# ©️ Codrago, 2024-2030
+# This file is a part of Heroku Userbot
+# 🌐 https://github.com/coddrago/Heroku
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import collections
+import time
+import typing
+
+
+class _Missing:
+    """Marks key, which was not present in owner"""
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+# Owner -> key -> value, or `MISSING` if key was removed
+OwnerKeys = typing.Dict[str, typing.Dict[str, typing.Any]]
+
+
+def copy_json(value: typing.Any) -> typing.Any:
+    """Deep copy of JSON-like value. Immutable leaves are shared"""
+    if isinstance(value, dict):
+        return {key: copy_json(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [copy_json(item) for item in value]
+
+    return value
+
+
+class Revision(typing.NamedTuple):
+    id: int
+    ts: float
+    # Frozen copies of keys, changed since the previous revision
+    changes: OwnerKeys
+
+
+class RevisionHistory:
+    """
+    Keeps last `limit` database states as a chain of per-key changes.
+    Only keys, which were written, are tracked: their value before the first
+    write is kept in the base state, and each revision copies only keys,
+    changed since the previous one. Revisions, which fall out of the history,
+    are folded into the base state, and base values of keys, which no retained
+    revision changes, are dropped, so memory is proportional to keys, changed
+    within the history
+    """
+
+    def __init__(self, limit: int = 15):
+        self.limit = limit
+        self._base: OwnerKeys = {}
+        self._revisions: typing.Deque[Revision] = collections.deque()
+        self._next_id = 1
+
+    def __len__(self) -> int:
+        return len(self._revisions)
+
+    def __bool__(self) -> bool:
+        return bool(self._revisions)
+
+    def __iter__(self) -> typing.Iterator[Revision]:
+        return iter(self._revisions)
+
+    def remember(self, owner: str, current: dict, keys: typing.Iterable[str]):
+        """
+        Save values of keys, which are about to be changed, unless history
+        already tracks them. Must be called before the change is applied.
+        Values, mutated in place without a write, are not noticed, so such
+        changes of untracked keys can't be rolled back
+        """
+        base = self._base.setdefault(owner, {})
+        for key in keys:
+            if key not in base:
+                base[key] = copy_json(current[key]) if key in current else MISSING
+
+    def record(
+        self,
+        db: dict,
+        changes: typing.Dict[str, typing.Set[str]],
+    ) -> Revision:
+        """Save the current values of changed keys as a new revision"""
+        frozen = {}
+        for owner, keys in changes.items():
+            values = dict.get(db, owner)
+            if not isinstance(values, dict):
+                values = {}
+
+            frozen[owner] = {
+                key: copy_json(values[key]) if key in values else MISSING
+                for key in keys
+            }
+
+        revision = Revision(self._next_id, time.time(), frozen)
+        self._next_id += 1
+        self._revisions.append(revision)
+
+        if len(self._revisions) > self.limit:
+            while len(self._revisions) > self.limit:
+                self._apply(self._base, self._revisions.popleft())
+
+            self._prune()
+
+        return revision
+
+    def _prune(self):
+        """
+        Drop base values of keys, which no retained revision changes. Every
+        retained state has the current value of such keys, so they are not
+        needed for restoring, and they are remembered again on the next write
+        """
+        touched: typing.Dict[str, typing.Set[str]] = {}
+        for revision in self._revisions:
+            for owner, values in revision.changes.items():
+                touched.setdefault(owner, set()).update(values)
+
+        for owner in list(self._base):
+            keys = touched.get(owner, ())
+            base = {
+                key: value for key, value in self._base[owner].items() if key in keys
+            }
+            if base:
+                self._base[owner] = base
+            else:
+                del self._base[owner]
+
+    @property
+    def latest(self) -> typing.Optional[Revision]:
+        return self._revisions[-1] if self._revisions else None
+
+    def get(self, revision_id: int) -> typing.Optional[Revision]:
+        return next(
+            (revision for revision in self._revisions if revision.id == revision_id),
+            None,
+        )
+
+    @staticmethod
+    def _apply(state: OwnerKeys, revision: Revision):
+        for owner, values in revision.changes.items():
+            state.setdefault(owner, {}).update(values)
+
+    def state(self, revision_id: int) -> OwnerKeys:
+        """
+        Build values of tracked keys at given revision. Keys, which are not
+        returned, were not changed since history had started. Returned values
+        are shared with history, so they must be copied before being modified
+        """
+        if not self.get(revision_id):
+            raise KeyError(f"Revision {revision_id} not found")
+
+        state = {owner: dict(values) for owner, values in self._base.items()}
+        for revision in self._revisions:
+            if revision.id > revision_id:
+                break
+
+            self._apply(state, revision)
+
+        return state
+
+    def changed_since(self, revision_id: int) -> typing.Set[str]:
+        """Owners, changed by revisions after given one"""
+        return {
+            owner
+            for revision in self._revisions
+            if revision.id > revision_id
+            for owner in revision.changes
+        }
+
+    @staticmethod
+    def diff_owner(old: typing.Optional[dict], new: typing.Optional[dict]) -> dict:
+        """Key-level difference between two states of owner"""
+        old = old or {}
+        new = new or {}
+        diff = {
+            "added": {key: value for key, value in new.items() if key not in old},
+            "removed": [key for key in old if key not in new],
+            "changed": {
+                key: (old[key], new[key])
+                for key in old.keys() & new.keys()
+                if old[key] != new[key]
+            },
+        }
+        return {kind: value for kind, value in diff.items() if value}
@@ -0,0 +1,625 @@
+"""Persistent storage engines for the database"""
+
+# ©️ Codrago, 2024-2030
+# This file is a part of Heroku Userbot
+# 🌐 https://github.com/coddrago/Heroku
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import typing
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+logger = logging.getLogger(__name__)
+
+# Owner -> set of changed keys, or `None` if the whole owner was replaced or removed
+Changes = typing.Dict[str, typing.Optional[typing.Set[str]]]
+
+JOURNAL_COMPACT_SIZE = 1024 * 1024  # 1 MB
+
+_LEGACY_OWNER_PREFIXES = ("hikka.", "legacy.")
+_LEGACY_PREFIXES = (
+    (re.compile(r'"(hikka\.)(\S+\":)'), re.compile(r"(hikka\.)(\S+\":)")),
+    (re.compile(r'"(legacy\.)(\S+\":)'), re.compile(r"(legacy\.)(\S+\":)")),
+)
+
+
+def migrate_legacy(data: str) -> str:
+    """Rename `hikka.` and `legacy.` owners, left from older versions, to `heroku.`"""
+    for lookup, pattern in _LEGACY_PREFIXES:
+        if lookup.search(data):
+            logger.warning("Converting db after update")
+            data = pattern.sub(lambda m: "heroku." + m.group(2), data)
+
+    return data
+
+
+def write_temp(path: Path, data: str) -> str:
+    """
+    Write data to a uniquely named temporary file next to `path`, so that
+    concurrent writers never share it. Returns name of the temporary file
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+    return tmp
+
+
+def write_atomic(path: Path, data: str):
+    """Write file contents via temporary file, so that it is never left half-written"""
+    os.replace(write_temp(path, data), path)
+
+
+def build_record(db: dict, changes: Changes) -> dict:
+    """Collect values of changed owners and keys into a single journal record"""
+    record = {}
+    for owner, keys in changes.items():
+        if owner not in db:
+            record.setdefault("d", []).append(owner)
+        elif keys is None:
+            record.setdefault("r", {})[owner] = db[owner]
+        else:
+            record.setdefault("s", {})[owner] = {
+                key: db[owner][key] for key in keys if key in db[owner]
+            }
+
+    return record
+
+
+def apply_record(db: dict, record: dict):
+    """Replay journal record on top of the database contents"""
+    for owner in record.get("d", ()):
+        db.pop(owner, None)
+
+    db.update(record.get("r", {}))
+
+    for owner, values in record.get("s", {}).items():
+        if not isinstance(db.get(owner), dict):
+            db[owner] = {}
+
+        db[owner].update(values)
+
+
+class JSONStorage:
+    """
+    Stores database in `config-<id>.json` snapshot and appends each change to
+    `config-<id>.json.journal`. Journal is replayed on read and folded into
+    the snapshot once it grows over `JOURNAL_COMPACT_SIZE`
+    """
+
+    # Whole database is returned by `read`
+    lazy = False
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.journal_path = path.with_name(f"{path.name}.journal")
+        # Increased by every full snapshot. Compaction, started before it,
+        # is based on outdated contents and must not replace newer snapshot
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def journal_size(self) -> int:
+        try:
+            return self.journal_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.journal_size > JOURNAL_COMPACT_SIZE
+
+    def read(self) -> dict:
+        """Read snapshot and replay journal on top of it"""
+        try:
+            db = json.loads(migrate_legacy(self.path.read_text()))
+        except json.decoder.JSONDecodeError:
+            logger.warning("Database read failed! Creating new one...")
+            db = {}
+        except FileNotFoundError:
+            logger.debug("Database file not found, creating new one...")
+            db = {}
+
+        try:
+            journal = migrate_legacy(self.journal_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return db
+
+        replayed = 0
+        for line in journal.splitlines():
+            try:
+                apply_record(db, json.loads(line))
+            except Exception:
+                # The last record may be torn if process was killed during write
+                logger.warning("Skipping broken database journal record")
+                continue
+
+            replayed += 1
+
+        logger.debug("Replayed %s database journal records", replayed)
+        return db
+
+    def write(self, db: dict, changes: Changes):
+        """Append changed owners and keys to journal"""
+        if not changes:
+            return
+
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(build_record(db, changes)) + "\n")
+
+    def snapshot(self, db: dict):
+        """Rewrite the whole snapshot and drop the journal"""
+        tmp = write_temp(self.path, json.dumps(db, indent=4))
+        with self._lock:
+            self._generation += 1
+            os.replace(tmp, self.path)
+            self.journal_path.unlink(missing_ok=True)
+
+    def begin_compaction(self, db: dict) -> typing.Tuple[str, int, int]:
+        """
+        Serialize database and remember journal position and snapshot
+        generation, it corresponds to. Must be called from the same thread,
+        that writes to database
+        """
+        return json.dumps(db, indent=4), self.journal_size, self._generation
+
+    def write_compaction(self, data: str, generation: int) -> bool:
+        """
+        Write serialized snapshot. Safe to run in a separate thread. Returns
+        `False` if a newer snapshot was written meanwhile, so that compaction
+        is cancelled
+        """
+        tmp = write_temp(self.path, data)
+        with self._lock:
+            if generation == self._generation:
+                os.replace(tmp, self.path)
+                return True
+
+        os.remove(tmp)
+        return False
+
+    def finish_compaction(self, offset: int, generation: int):
+        """
+        Drop journal records, which are already included in snapshot.
+        Must be called from the same thread, that writes to database
+        """
+        if generation != self._generation:
+            # Journal was already dropped by newer snapshot and may have
+            # been started anew, so offset doesn't point to the same record
+            return
+
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+        except FileNotFoundError:
+            return
+
+        if tail:
+            write_atomic(self.journal_path, tail.decode("utf-8"))
+        else:
+            self.journal_path.unlink(missing_ok=True)
+
+
+class ShardedStorage:
+    """
+    Stores each owner in its own file under database directory. Owners are
+    read only when they are first accessed, and each one is written
+    independently of others
+    """
+
+    # Owners are read one by one with `read_owner`
+    lazy = True
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Owner -> hash of last written contents, so that unchanged owners
+        # are not rewritten
+        self._written: typing.Dict[str, int] = {}
+        self._files: typing.Set[str] = set()
+
+    @property
+    def exists(self) -> bool:
+        return self.path.is_dir()
+
+    @property
+    def needs_compaction(self) -> bool:
+        return False
+
+    def _owner_path(self, owner: str) -> Path:
+        return self.path / f"{quote(str(owner), safe='')}.json"
+
+    def import_from(self, storage: JSONStorage):
+        """Split existing single-file database into owner files"""
+        db = storage.read()
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        tmp.mkdir(parents=True, exist_ok=True)
+        for owner, value in db.items():
+            write_atomic(tmp / self._owner_path(owner).name, json.dumps(value))
+
+        os.replace(tmp, self.path)
+        logger.info("Split database into %s owner files", len(db))
+
+    def owners(self) -> typing.Set[str]:
+        """List owners, stored on disk, renaming ones with legacy prefixes"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._files = set()
+        for file in self.path.glob("*.json"):
+            owner = unquote(file.stem)
+            if owner.startswith(_LEGACY_OWNER_PREFIXES):
+                migrated = "heroku." + owner.split(".", maxsplit=1)[1]
+                if (target := self._owner_path(migrated)).exists():
+                    logger.warning(
+                        "Skipping legacy owner %s, %s exists", owner, migrated
+                    )
+                    continue
+
+                logger.warning("Converting db owner %s after update", owner)
+                os.replace(file, target)
+                owner = migrated
+
+            self._files.add(owner)
+
+        return set(self._files)
+
+    def read(self) -> dict:
+        """Owners are loaded lazily, so nothing is read upfront"""
+        return {}
+
+    def read_owner(self, owner: str) -> dict:
+        """Read contents of a single owner"""
+        path = self._owner_path(owner)
+        try:
+            data = path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return {}
+
+        if (migrated := migrate_legacy(data)) != data:
+            # Migration is persisted, so it runs only once per owner
+            write_atomic(path, migrated)
+            data = migrated
+
+        try:
+            value = json.loads(data)
+        except json.decoder.JSONDecodeError:
+            logger.warning("Database owner %s is broken, resetting it", owner)
+            return {}
+
+        self._written[owner] = hash(data)
+        return value
+
+    def _write_owner(self, db: dict, owner: str):
+        if owner not in db:
+            self._written.pop(owner, None)
+            self._files.discard(owner)
+            self._owner_path(owner).unlink(missing_ok=True)
+            return
+
+        data = json.dumps(db[owner])
+        if self._written.get(owner) != (digest := hash(data)):
+            write_atomic(self._owner_path(owner), data)
+            self._written[owner] = digest
+            self._files.add(owner)
+
+    def write(self, db: dict, changes: Changes):
+        """Rewrite files of changed owners"""
+        for owner in changes:
+            self._write_owner(db, owner)
+
+    def snapshot(self, db: dict):
+        """
+        Write all loaded owners and remove files of owners, which are no
+        longer in database. Owners, which were not loaded, are kept as is
+        """
+        for owner in dict.keys(db):
+            self._write_owner(db, owner)
+
+        for owner in list(self._files):
+            if owner not in db:
+                self._write_owner(db, owner)
+
+
+class SQLiteStorage:
+    """
+    Stores each database key as a separate `(owner, key, value)` row in SQLite
+    file in WAL mode. Changed keys are upserted in a single transaction, and
+    owners are read only when they are first accessed
+    """
+
+    lazy = True
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn: typing.Optional[sqlite3.Connection] = None
+        # Owner -> hash of last written contents, so that unchanged owners
+        # are not rewritten on full saves
+        self._written: typing.Dict[str, int] = {}
+        self._owners: typing.Set[str] = set()
+
+    @property
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @property
+    def needs_compaction(self) -> bool:
+        return False
+
+    @staticmethod
+    def _create_table(conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS db (owner TEXT NOT NULL, key TEXT NOT"
+            " NULL, value TEXT NOT NULL, PRIMARY KEY (owner, key)) WITHOUT ROWID"
+        )
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_table(self._conn)
+
+        return self._conn
+
+    def import_from(self, storage: JSONStorage):
+        """
+        Copy existing single-file database into SQLite. Database is built in a
+        temporary file and moved into place once complete, so that import,
+        interrupted by crash, is started over on next boot
+        """
+        db = storage.read()
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        tmp.unlink(missing_ok=True)
+
+        conn = sqlite3.connect(tmp)
+        try:
+            self._create_table(conn)
+            with conn:
+                conn.executemany(
+                    "INSERT INTO db (owner, key, value) VALUES (?, ?, ?)",
+                    [
+                        (str(owner), str(key), json.dumps(value))
+                        for owner, values in db.items()
+                        for key, value in values.items()
+                    ],
+                )
+        finally:
+            conn.close()
+
+        os.replace(tmp, self.path)
+        logger.info("Imported %s database owners into SQLite", len(db))
+
+    def owners(self) -> typing.Set[str]:
+        self._owners = {
+            row[0] for row in self.conn.execute("SELECT DISTINCT owner FROM db")
+        }
+        return set(self._owners)
+
+    def read(self) -> dict:
+        """Owners are loaded lazily, so nothing is read upfront"""
+        return {}
+
+    def read_owner(self, owner: str) -> dict:
+        """Read all keys of a single owner"""
+        value = {}
+        for key, data in self.conn.execute(
+            "SELECT key, value FROM db WHERE owner = ?",
+            (str(owner),),
+        ):
+            try:
+                value[key] = json.loads(data)
+            except json.decoder.JSONDecodeError:
+                logger.warning("Skipping broken database key %s of %s", key, owner)
+
+        self._written[owner] = hash(json.dumps(value))
+        return value
+
+    def _replace_owner(self, db: dict, owner: str):
+        self.conn.execute("DELETE FROM db WHERE owner = ?", (str(owner),))
+        if owner not in db:
+            self._written.pop(owner, None)
+            self._owners.discard(owner)
+            return
+
+        self.conn.executemany(
+            "INSERT INTO db (owner, key, value) VALUES (?, ?, ?)",
+            [
+                (str(owner), str(key), json.dumps(value))
+                for key, value in db[owner].items()
+            ],
+        )
+        self._written[owner] = hash(json.dumps(db[owner]))
+        self._owners.add(owner)
+
+    def write(self, db: dict, changes: Changes):
+        """Upsert changed keys and replace owners, which were changed as a whole"""
+        with self.conn:
+            for owner, keys in changes.items():
+                if keys is None or owner not in db:
+                    self._replace_owner(db, owner)
+                    continue
+
+                values = db[owner]
+                self.conn.executemany(
+                    "INSERT INTO db (owner, key, value) VALUES (?, ?, ?) ON"
+                    " CONFLICT (owner, key) DO UPDATE SET value = excluded.value",
+                    [
+                        (str(owner), str(key), json.dumps(values[key]))
+                        for key in keys
+                        if key in values
+                    ],
+                )
+                self.conn.executemany(
+                    "DELETE FROM db WHERE owner = ? AND key = ?",
+                    [(str(owner), str(key)) for key in keys if key not in values],
+                )
+                self._written.pop(owner, None)
+                self._owners.add(owner)
+
+    def snapshot(self, db: dict):
+        """
+        Replace all loaded owners, which were changed since they were last
+        written, and remove owners, which are no longer in database
+        """
+        with self.conn:
+            for owner in dict.keys(db):
+                if self._written.get(owner) != hash(json.dumps(db[owner])):
+                    self._replace_owner(db, owner)
+
+            for owner in list(self._owners):
+                if owner not in db:
+                    self._replace_owner(db, owner)
+
+
+class RedisStorage:
+    """
+    Stores each owner as a Redis hash of JSON-encoded keys. Only changed keys
+    are pushed, in a single pipeline, and the whole database is loaded with
+    one round trip
+    """
+
+    lazy = False
+
+    def __init__(self, client: typing.Any, prefix: str):
+        """
+        :param client: `redis.Redis` or any object with the same interface,
+            e.g. `fakeredis.FakeRedis`
+        :param prefix: Key, under which database of this client is stored
+        """
+        self._redis = client
+        self._legacy_key = prefix
+        self._owners_key = f"{prefix}:db"
+        # Owner -> hash of last written contents, so that unchanged owners
+        # are not re-uploaded on full saves
+        self._written: typing.Dict[str, int] = {}
+        self._owners: typing.Set[str] = set()
+
+    @property
+    def needs_compaction(self) -> bool:
+        return False
+
+    def _owner_key(self, owner: str) -> str:
+        return f"{self._owners_key}:{owner}"
+
+    def read(self) -> dict:
+        """Load all owners in a single pipeline"""
+        owners = sorted(
+            owner.decode() for owner in self._redis.smembers(self._owners_key)
+        )
+        if not owners and (legacy := self._redis.get(self._legacy_key)):
+            return self._import_legacy(json.loads(legacy.decode()))
+
+        with self._redis.pipeline(transaction=False) as pipe:
+            for owner in owners:
+                pipe.hgetall(self._owner_key(owner))
+
+            contents = pipe.execute()
+
+        db = {}
+        for owner, values in zip(owners, contents):
+            db[owner] = {}
+            for key, data in values.items():
+                try:
+                    db[owner][key.decode()] = json.loads(data)
+                except json.decoder.JSONDecodeError:
+                    logger.warning("Skipping broken database key %s of %s", key, owner)
+
+            self._written[owner] = hash(json.dumps(db[owner]))
+
+        self._owners = set(owners)
+        return db
+
+    def _import_legacy(self, db: dict) -> dict:
+        """Split database, stored as a single JSON string, into owner hashes"""
+        self.prepare(db, {}, snapshot=True)()
+        logger.info("Split Redis database into %s owner hashes", len(db))
+        return db
+
+    def _replace_owner(self, pipe: typing.Any, db: dict, owner: str):
+        pipe.delete(self._owner_key(owner))
+        if owner not in db:
+            pipe.srem(self._owners_key, owner)
+            self._owners.discard(owner)
+            self._written.pop(owner, None)
+            return
+
+        pipe.sadd(self._owners_key, owner)
+        if db[owner]:
+            pipe.hset(
+                self._owner_key(owner),
+                mapping={
+                    str(key): json.dumps(value) for key, value in db[owner].items()
+                },
+            )
+
+        self._owners.add(owner)
+        self._written[owner] = hash(json.dumps(db[owner]))
+
+    def prepare(
+        self,
+        db: dict,
+        changes: Changes,
+        snapshot: bool = False,
+    ) -> typing.Callable[[], typing.Any]:
+        """
+        Collect changed values into a pipeline. Must be called from the same
+        thread, that writes to database. Returned function sends the pipeline
+        and is safe to run in a separate thread
+        """
+        pipe = self._redis.pipeline()
+        if snapshot:
+            changes = dict.fromkeys(self._owners | set(dict.keys(db)))
+
+        for owner, keys in changes.items():
+            if keys is None or owner not in db:
+                if (
+                    snapshot
+                    and owner in db
+                    and self._written.get(owner) == hash(json.dumps(db[owner]))
+                ):
+                    continue
+
+                self._replace_owner(pipe, db, owner)
+                continue
+
+            values = db[owner]
+            if updated := {
+                str(key): json.dumps(values[key]) for key in keys if key in values
+            }:
+                pipe.hset(self._owner_key(owner), mapping=updated)
+
+            if removed := [str(key) for key in keys if key not in values]:
+                pipe.hdel(self._owner_key(owner), *removed)
+
+            pipe.sadd(self._owners_key, owner)
+            self._owners.add(owner)
+            self._written.pop(owner, None)
+
+        return pipe.execute
+
+    def write(self, db: dict, changes: Changes):
+        self.prepare(db, changes)()
+
+    def snapshot(self, db: dict):
+        self.prepare(db, {}, snapshot=True)()
+
+    def forget(self):
+        """Drop written contents cache, e.g. after failed write"""
+        self._written = {}
+
+
+Storage = typing.Union[JSONStorage, ShardedStorage, SQLiteStorage, RedisStorage]
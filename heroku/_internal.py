@@ -12,6 +12,10 @@
 
 import asyncio
 import atexit
+import contextlib
+import contextvars
+import functools
+import inspect
 import logging
 import os
 import random
@@ -19,6 +23,67 @@ import signal
 import sys
 import subprocess
 import re
+import typing
+
+
+# Id of the client, on whose behalf the current code runs. Set by entry points
+# (dispatchers, module registration, loops), read by `TelegramLogsHandler` to
+# route log records to the right client's log chat
+logging_client_id: contextvars.ContextVar[typing.Optional[int]] = (
+    contextvars.ContextVar("heroku_logging_client_id", default=None)
+)
+
+
+@contextlib.contextmanager
+def logging_client(client_id: typing.Optional[int]):
+    """Attribute log records to client within the block, then restore previous one"""
+    if client_id is None:
+        yield
+        return
+
+    token = logging_client_id.set(client_id)
+    try:
+        yield
+    finally:
+        logging_client_id.reset(token)
+
+
+def logs_as_client(get_client_id: typing.Callable[[typing.Any], int]):
+    """
+    Attribute log records, emitted by decorated method, to client, whose id is
+    returned by `get_client_id(self)`. Ignored if client is not available yet
+    """
+
+    def _client_id(instance: typing.Any) -> typing.Optional[int]:
+        try:
+            return get_client_id(instance)
+        except AttributeError:
+            return None
+
+    def decorator(func: typing.Callable) -> typing.Callable:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(self, *args, **kwargs):
+                with logging_client(_client_id(self)):
+                    return await func(self, *args, **kwargs)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                with logging_client(_client_id(self)):
+                    return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Called right before the process is replaced on restart. Neither shutdown
+# handler nor pending background tasks run after that, so anything, which
+# must survive restart (e.g. delayed database writes), is written here
+restart_hooks: typing.List[typing.Callable[[], typing.Any]] = []
 
 
 async def fw_protect():
@@ -56,6 +121,12 @@ def restart():
         )
         sys.exit(0)
 
+    for hook in restart_hooks:
+        try:
+            hook()
+        except Exception:
+            logging.exception("Restart hook %s failed", hook)
+
     logging.getLogger().setLevel(logging.CRITICAL)
 
     print("🔄 Restarting...")
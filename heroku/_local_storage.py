@@ -29,6 +29,7 @@ logger = logging.getLogger(__name__)
 
 MAX_FILESIZE = 1024 * 1024 * 5  # 5 MB
 MAX_TOTALSIZE = 1024 * 1024 * 100  # 100 MB
+DEFAULT_FETCH_CONCURRENCY = 8
 
 
 class LocalStorage:
@@ -102,6 +103,20 @@ class RemoteStorage:
     def __init__(self, client: CustomTelegramClient):
         self._local_storage = LocalStorage()
         self._client = client
+        self._pool_size = DEFAULT_FETCH_CONCURRENCY
+        self._session = self._make_session(self._pool_size)
+
+    @staticmethod
+    def _make_session(pool_size: int) -> requests.Session:
+        """Session, which keeps connections to module hosts alive between fetches"""
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     async def preload(self, urls: typing.List[str]):
         """Preloads modules from remote storage."""
@@ -148,7 +163,7 @@ class RemoteStorage:
         url, repo, module_name = self._parse_url(url)
         try:
             r = await utils.run_sync(
-                requests.get,
+                self._session.get,
                 url,
                 auth=(tuple(auth.split(":", 1)) if auth else None),
                 headers={
@@ -173,3 +188,33 @@ class RemoteStorage:
         self._local_storage.save(repo, module_name, r.text)
 
         return r.text
+
+    async def fetch_many(
+        self,
+        urls: typing.List[str],
+        auth: typing.Optional[str] = None,
+        limit: int = DEFAULT_FETCH_CONCURRENCY,
+    ) -> typing.List[typing.Union[str, Exception]]:
+        """
+        Fetches several modules concurrently, running at most `limit` requests
+        at a time over the shared session.
+        :param urls: URLs to the modules.
+        :param auth: Optional authentication string in the format "username:password".
+        :param limit: Maximum number of simultaneous requests.
+        :return: Module sources or exceptions, in the order of `urls`.
+        """
+        if limit > self._pool_size:
+            self._session.close()
+            self._pool_size = limit
+            self._session = self._make_session(limit)
+
+        semaphore = asyncio.Semaphore(limit)
+
+        async def _fetch(url: str) -> str:
+            async with semaphore:
+                return await self.fetch(url, auth=auth)
+
+        return await asyncio.gather(
+            *(_fetch(url) for url in urls),
+            return_exceptions=True,
+        )
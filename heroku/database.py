@@ -12,11 +12,11 @@
 
 import asyncio
 import collections
-import inspect
+import functools
 import json
 import logging
 import os
-import re
+import sys
 import time
 
 try:
@@ -31,6 +31,16 @@ import typing
 from herokutl.tl.types import Message, User
 
 from . import main, utils
+from ._internal import restart_hooks
+from ._db_revisions import MISSING, RevisionHistory, copy_json
+from ._db_storage import (
+    Changes,
+    JSONStorage,
+    RedisStorage,
+    ShardedStorage,
+    SQLiteStorage,
+    Storage,
+)
 from .pointers import (
     BaseSerializingMiddlewareDict,
     BaseSerializingMiddlewareList,
@@ -55,6 +65,15 @@ __all__ = [
 logger = logging.getLogger(__name__)
 _DB_PROTECTED_OWNERS = {"HerokuPluginSecurity"}
 _DB_ALLOWED_WRITERS = {f"{__package__}.modules.heroku_plugin_security"}
+# Modules, which only forward writes and are skipped when looking for caller
+_DB_TRANSPARENT_CALLERS = frozenset({__name__, f"{__package__}.pointers"})
+
+# Changes are written by background task after this delay (in seconds),
+# or immediately, once this many keys are pending. Can be overriden with
+# `db_save_delay` and `db_save_threshold` keys in config.json
+DEFAULT_SAVE_DELAY = 1
+DEFAULT_REDIS_SAVE_DELAY = 5
+DEFAULT_SAVE_THRESHOLD = 1000
 
 
 class NoAssetsChannel(Exception):
@@ -66,14 +85,35 @@ class NoContentChannel(Exception):
 
 
 class Database(dict):
-    def __init__(self, client: CustomTelegramClient):
+    def __init__(
+        self,
+        client: CustomTelegramClient,
+        redis_client: typing.Optional["redis.Redis"] = None,
+    ):
+        """
+        :param redis_client: Redis client to use instead of one, created from
+            `REDIS_URL`. Any object with `redis.Redis` interface will work,
+            e.g. `fakeredis.FakeRedis`
+        """
         super().__init__()
         self._client: CustomTelegramClient = client
         self._next_revision_call: int = 0
-        self._revisions: typing.List[dict] = []
+        self._history = RevisionHistory()
+        # Owner -> keys, changed since the last revision
+        self._revision_dirty: typing.Dict[str, typing.Set[str]] = {}
         self._me: User = None
-        self._redis: redis.Redis = None
+        self._redis: "redis.Redis" = redis_client
         self._saving_task: asyncio.Future = None
+        self._owner_versions: typing.Dict[str, int] = collections.defaultdict(int)
+        self._dirty: Changes = {}
+        self._snapshot_required: bool = False
+        self._storage: Storage = None
+        # Owners, which are stored on disk, but not loaded yet
+        self._unloaded: typing.Set[str] = set()
+        self._compaction_task: asyncio.Future = None
+        self._pending_writes: int = 0
+        self._save_delay: float = 0
+        self._save_threshold: int = DEFAULT_SAVE_THRESHOLD
 
     def __repr__(self):
         return object.__repr__(self)
@@ -91,19 +131,52 @@ class Database(dict):
         if not self._redis:
             return False
 
-        await utils.run_sync(self._redis_save_sync)
-        logger.debug("Published db to Redis")
-        return True
+        return await self.flush()
+
+    async def _flush_later(self):
+        """Write pending changes once save delay has passed"""
+        await asyncio.sleep(self._save_delay)
+        self._saving_task = None
+        await self.flush()
+
+    def flush_sync(self) -> bool:
+        """
+        Write all pending changes to storage, blocking the caller. For places,
+        where event loop won't get a chance to run the delayed save, e.g. restart
+        """
+        if self._saving_task:
+            self._saving_task.cancel()
+            self._saving_task = None
+
+        if not self._dirty and not self._snapshot_required:
+            return True
+
+        return self._persist()
+
+    async def flush(self) -> bool:
+        """Write all pending changes to storage immediately"""
+        if self._saving_task:
+            self._saving_task.cancel()
+            self._saving_task = None
 
-    async def _redis_save(self) -> bool:
-        """Save database to redis"""
         if not self._redis:
+            return self._persist()
+
+        changes, self._dirty = self._dirty, {}
+        snapshot, self._snapshot_required = self._snapshot_required, False
+        self._pending_writes = 0
+
+        try:
+            if isinstance(self._storage, RedisStorage):
+                await utils.run_sync(self._storage.prepare(self, changes, snapshot))
+            else:
+                await utils.run_sync(self._redis_save_sync)
+        except Exception:
+            logger.exception("Database save failed!")
+            self._storage_failed()
             return False
 
-        await asyncio.sleep(5)
-        await utils.run_sync(self._redis_save_sync)
         logger.debug("Published db to Redis")
-        self._saving_task = None
         return True
 
     async def redis_init(self) -> bool:
@@ -117,18 +190,46 @@ class Database(dict):
 
     async def init(self):
         """Asynchronous initialization unit"""
-        if os.environ.get("REDIS_URL") or main.get_config_key("redis_uri"):
+        if not self._redis and (
+            os.environ.get("REDIS_URL") or main.get_config_key("redis_uri")
+        ):
             await self.redis_init()
 
+        save_delay = main.get_config_key("db_save_delay")
+        self._save_delay = (
+            save_delay
+            if isinstance(save_delay, (int, float)) and not isinstance(save_delay, bool)
+            else DEFAULT_REDIS_SAVE_DELAY if self._redis else DEFAULT_SAVE_DELAY
+        )
+        self._save_threshold = (
+            main.get_config_key("db_save_threshold") or DEFAULT_SAVE_THRESHOLD
+        )
+
         self._db_file = main.BASE_PATH / f"config-{self._client.tg_id}.json"
+        self._storage = JSONStorage(self._db_file)
+        backend = os.environ.get("DB_BACKEND") or main.get_config_key("db_backend")
+        if self._redis and backend == "redis_hash":
+            self._storage = RedisStorage(self._redis, str(self._client.tg_id))
+        elif not self._redis and backend in {"sharded", "sqlite"}:
+            legacy, self._storage = self._storage, (
+                ShardedStorage(main.BASE_PATH / f"config-{self._client.tg_id}.d")
+                if backend == "sharded"
+                else SQLiteStorage(main.BASE_PATH / f"config-{self._client.tg_id}.db")
+            )
+            if not self._storage.exists:
+                self._storage.import_from(legacy)
+
         self.read()
+        restart_hooks.append(self.flush_sync)
 
     def read(self):
         """Read database and stores it in self"""
         if self._redis:
             try:
                 self._update_from_read(
-                    json.loads(
+                    self._storage.read()
+                    if isinstance(self._storage, RedisStorage)
+                    else json.loads(
                         self._redis.get(
                             str(self._client.tg_id),
                         ).decode(),
@@ -138,29 +239,117 @@ class Database(dict):
                 logger.exception("Error reading redis database")
             return
 
-        try:
-            db = self._db_file.read_text()
-            if re.search(r'"(hikka\.)(\S+\":)', db):
-                logging.warning("Converting db after update")
-                db = re.sub(r"(hikka\.)(\S+\":)", lambda m: "heroku." + m.group(2), db)
-            if re.search(r'"(legacy\.)(\S+\":)', db):
-                logging.warning("Converting db after update")
-                db = re.sub(r"(legacy\.)(\S+\":)", lambda m: "heroku." + m.group(2), db)
-            self._update_from_read(json.loads(db))
-        except json.decoder.JSONDecodeError:
-            logger.warning("Database read failed! Creating new one...")
-        except FileNotFoundError:
-            logger.debug("Database file not found, creating new one...")
+        if self._storage.lazy:
+            self._unloaded = self._storage.owners()
+            return
+
+        self._update_from_read(self._storage.read())
 
     def _update_from_read(self, items: dict) -> None:
         """Update DB from persisted storage without write-protection checks."""
         super().update(items)
+        self._touch(*items)
+
+    def _load(self, owner: str) -> None:
+        """Read owner from lazy storage, if it was not accessed yet"""
+        if owner not in self._unloaded:
+            return
+
+        self._unloaded.discard(owner)
+        super().__setitem__(owner, self._storage.read_owner(owner))
+
+    def load_all(self) -> None:
+        """Read all owners, which were not accessed yet, from lazy storage"""
+        for owner in list(self._unloaded):
+            self._load(owner)
+
+    def __missing__(self, owner: str) -> typing.Any:
+        if owner not in self._unloaded:
+            raise KeyError(owner)
+
+        self._load(owner)
+        return super().__getitem__(owner)
+
+    def __contains__(self, owner: typing.Any) -> bool:
+        return super().__contains__(owner) or owner in self._unloaded
+
+    # Whole database views include owners, which were not loaded yet
+    def __iter__(self) -> typing.Iterator[str]:
+        self.load_all()
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        return super().__len__() + len(self._unloaded)
+
+    def keys(self) -> typing.KeysView:
+        self.load_all()
+        return super().keys()
 
-    def process_db_autofix(self, db: dict) -> bool:
-        if not utils.is_serializable(db):
+    def values(self) -> typing.ValuesView:
+        self.load_all()
+        return super().values()
+
+    def items(self) -> typing.ItemsView:
+        self.load_all()
+        return super().items()
+
+    def _mark_dirty(self, owner: str, key: typing.Optional[str] = None) -> None:
+        """Remember changed key (or the whole owner) to persist it on next save"""
+        if key is None:
+            self._dirty[owner] = None
+        elif (keys := self._dirty.setdefault(owner, set())) is not None:
+            keys.add(key)
+
+        self._pending_writes += 1
+
+    def _remember(self, owner: str, keys: typing.Iterable[str]) -> None:
+        """Keep values of keys, which are about to change, in revision history"""
+        if not (keys := list(keys)):
+            return
+
+        current = super().get(owner)
+        self._history.remember(
+            owner,
+            current if isinstance(current, dict) else {},
+            keys,
+        )
+        self._revision_dirty.setdefault(owner, set()).update(keys)
+
+    def _remember_owner(self, owner: str, value: typing.Any = None) -> None:
+        """Same as `_remember`, but for owner, which is replaced with `value`"""
+        self._load(owner)
+        current = super().get(owner)
+        keys = set(current) if isinstance(current, dict) else set()
+        if isinstance(value, dict):
+            keys.update(value)
+
+        self._remember(owner, keys)
+
+    def _touch(self, *owners: str) -> None:
+        """Mark owners as changed, so that compiled caches can be rebuilt"""
+        for owner in owners:
+            self._owner_versions[owner] += 1
+
+    def owner_version(self, owner: str) -> int:
+        """
+        Get change counter of owner
+        It increases on every write to the owner, so consumers can cache values
+        derived from the database and rebuild them only when the counter changes
+        """
+        return self._owner_versions[owner]
+
+    def process_db_autofix(
+        self,
+        db: dict,
+        owners: typing.Optional[typing.Iterable[str]] = None,
+    ) -> bool:
+        owners = list(db) if owners is None else [o for o in owners if o in db]
+
+        if not utils.is_serializable({owner: db[owner] for owner in owners}):
             return False
 
-        for key, value in db.copy().items():
+        for key in owners:
+            value = db[key]
             if not isinstance(key, (str, int)):
                 logger.warning(
                     "DbAutoFix: Dropped key %s, because it is not string or int",
@@ -179,7 +368,7 @@ class Database(dict):
                 )
                 continue
 
-            for subkey in value:
+            for subkey in list(value):
                 if not isinstance(subkey, (str, int)):
                     del db[key][subkey]
                     logger.warning(
@@ -196,45 +385,199 @@ class Database(dict):
 
     def save(self) -> bool:
         """Save database"""
-        if not self.process_db_autofix(self):
-            try:
-                rev = self._revisions.pop()
-                while not self.process_db_autofix(rev):
-                    rev = self._revisions.pop()
-            except IndexError:
+        # Values may have been changed in-place, so the whole database is persisted
+        self._snapshot_required = True
+        # Owners, which were not loaded, can't be changed in-place. Revision
+        # history only tracks writes, done via database methods
+        self._dirty.update(dict.fromkeys(super().keys()))
+        return self._save()
+
+    def _save(self) -> bool:
+        """Save changes, collected since the last save"""
+        # Keys, written via `set`, are validated there, so only owners, which
+        # were replaced as a whole, need to be checked
+        if not self.process_db_autofix(
+            self,
+            (
+                list(super().keys())
+                if self._snapshot_required
+                else [owner for owner, keys in self._dirty.items() if keys is None]
+            ),
+        ):
+            if not self._history:
                 raise RuntimeError(
                     "Can't find revision to restore broken database from "
                     "database is most likely broken and will lead to problems, "
                     "so its save is forbidden."
                 )
 
-            self.clear()
-            self.update(**rev)
+            # Revisions are recorded only after successful autofix, so the
+            # latest one is always valid
+            self._restore(self._history.state(self._history.latest.id))
 
             raise RuntimeError(
                 "Rewriting database to the last revision because new one destructed it"
             )
 
-        if self._next_revision_call < time.time():
-            self._revisions += [dict(self)]
+        if self._revision_dirty and self._next_revision_call < time.time():
+            self._history.record(self, self._revision_dirty)
+            self._revision_dirty = {}
             self._next_revision_call = time.time() + 3
 
-        while len(self._revisions) > 15:
-            self._revisions.pop()
+        return self._schedule_flush()
 
-        if self._redis:
-            if not self._saving_task:
-                self._saving_task = asyncio.ensure_future(self._redis_save())
-            return True
+    def _restore(self, state: dict):
+        """Put values of keys, tracked by revision history, back into database"""
+        restored = {}
+        for owner, values in state.items():
+            self._load(owner)
+            current = super().get(owner)
+            current = current if isinstance(current, dict) else {}
+            value = dict(current)
+            for key, item in values.items():
+                if item is MISSING:
+                    value.pop(key, None)
+                else:
+                    value[key] = copy_json(item)
+
+            if value != current:
+                restored[owner] = value
+
+        self.update(restored)
+
+    def list_revisions(self) -> typing.List[typing.Tuple[int, float, typing.List[str]]]:
+        """
+        List saved revisions of database
+        :return: List of (revision id, timestamp, owners changed in revision)
+        """
+        return [
+            (revision.id, revision.ts, sorted(revision.changes, key=str))
+            for revision in self._history
+        ]
+
+    def diff_revision(
+        self,
+        revision_id: int,
+        other_id: typing.Optional[int] = None,
+    ) -> typing.Dict[str, dict]:
+        """
+        Get difference between revision and another one or the current database
+        :param revision_id: Revision to compare from
+        :param other_id: Revision to compare to. Current database if not specified
+        :return: Owner -> dict with `added`, `removed` and `changed` keys
+        """
+        old = self._history.state(revision_id)
+        if other_id is None:
+            new = None
+            owners = self._history.changed_since(revision_id)
+            owners.update(self._revision_dirty)
+        else:
+            new = self._history.state(other_id)
+            owners = self._history.changed_since(min(revision_id, other_id))
+
+        diffs = {}
+        for owner in owners:
+            before = old.get(owner, {})
+            if new is not None:
+                after = new.get(owner, {})
+            else:
+                # Only keys, tracked by history, are compared
+                current = self[owner] if owner in self else {}
+                after = {key: current[key] for key in before if key in current}
+
+            if diff := self._history.diff_owner(
+                {key: value for key, value in before.items() if value is not MISSING},
+                {key: value for key, value in after.items() if value is not MISSING},
+            ):
+                diffs[owner] = diff
+
+        return diffs
+
+    def rollback(self, revision_id: int) -> bool:
+        """
+        Roll database back to the saved revision
+        :param revision_id: Revision to roll back to
+        :return: `True` on success, `False` if revision is not found
+        """
+        if not self._history.get(revision_id):
+            return False
+
+        self._restore(self._history.state(revision_id))
+        return self._save()
+
+    def _schedule_flush(self) -> bool:
+        """Coalesce pending changes and write them after save delay"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Nothing will run the background task, so write right away
+            return self._persist()
+
+        if not self._redis and (
+            self._save_delay <= 0 or self._pending_writes >= self._save_threshold
+        ):
+            return self._persist()
+
+        if not self._saving_task:
+            self._saving_task = asyncio.ensure_future(self._flush_later())
+
+        return True
+
+    def _persist(self) -> bool:
+        """Write collected changes to storage"""
+        changes, self._dirty = self._dirty, {}
+        snapshot, self._snapshot_required = self._snapshot_required, False
+        self._pending_writes = 0
 
         try:
-            self._db_file.write_text(json.dumps(self, indent=4))
+            if self._redis and not isinstance(self._storage, RedisStorage):
+                self._redis_save_sync()
+            elif snapshot:
+                self._storage.snapshot(self)
+            else:
+                self._storage.write(self, changes)
         except Exception:
             logger.exception("Database save failed!")
+            self._storage_failed()
             return False
 
+        if self._redis or self._compaction_task or not self._storage.needs_compaction:
+            return True
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # No running event loop, compaction will be started on next write
+            return True
+
+        self._compaction_task = asyncio.ensure_future(self._compact())
         return True
 
+    def _storage_failed(self):
+        """Write everything next time, as storage may be left behind after failure"""
+        self._snapshot_required = True
+        if isinstance(self._storage, RedisStorage):
+            self._storage.forget()
+
+    async def _compact(self):
+        """Fold database journal into snapshot without blocking event loop on I/O"""
+        try:
+            data, offset, generation = self._storage.begin_compaction(self)
+            if not await utils.run_sync(
+                self._storage.write_compaction,
+                data,
+                generation,
+            ):
+                logger.debug("Database journal compaction superseded by snapshot")
+                return
+
+            self._storage.finish_compaction(offset, generation)
+            logger.debug("Compacted database journal")
+        except Exception:
+            logger.exception("Database journal compaction failed")
+        finally:
+            self._compaction_task = None
+
     async def store_asset(self, message: Message) -> int:
         """
         Save assets
@@ -303,8 +646,19 @@ class Database(dict):
         except KeyError:
             return default
 
-    def set(self, owner: str, key: str, value: JSONSerializable) -> bool:
-        """Set database key"""
+    def set(
+        self,
+        owner: str,
+        key: str,
+        value: JSONSerializable,
+        *,
+        trusted: bool = False,
+    ) -> bool:
+        """
+        Set database key
+        :param trusted: Skip value validation. Only for core code, which writes
+            values it built itself. Ignored for external modules
+        """
         if owner in _DB_PROTECTED_OWNERS:
             caller = self._get_write_caller()
             if caller not in _DB_ALLOWED_WRITERS:
@@ -324,15 +678,19 @@ class Database(dict):
                 "JSON-serializable key which will cause errors"
             )
 
-        if not utils.is_serializable(value):
+        if not trusted and not utils.is_serializable(value):
             raise RuntimeError(
                 "Attempted to write object of "
                 f"{key=} ({type(value)=}) to database. It is not "
                 "JSON-serializable value which will cause errors"
             )
 
+        self._load(owner)
+        self._remember(owner, (key,))
         super().setdefault(owner, {})[key] = value
-        return self.save()
+        self._touch(owner)
+        self._mark_dirty(owner, key)
+        return self._save()
 
     def __setitem__(self, owner: str, value: JSONSerializable) -> None:
         if owner in _DB_PROTECTED_OWNERS:
@@ -354,7 +712,34 @@ class Database(dict):
                 "JSON-serializable value which will cause errors"
             )
 
+        self._remember_owner(owner, value)
         super().__setitem__(owner, value)
+        self._touch(owner)
+        self._mark_dirty(owner)
+
+    def __delitem__(self, owner: str) -> None:
+        self._remember_owner(owner)
+        super().__delitem__(owner)
+        self._touch(owner)
+        self._mark_dirty(owner)
+
+    def pop(self, owner: str, *args) -> typing.Any:
+        self._remember_owner(owner)
+        value = super().pop(owner, *args)
+        self._touch(owner)
+        self._mark_dirty(owner)
+        return value
+
+    def clear(self) -> None:
+        self.load_all()
+        owners = list(super().keys())
+        for owner in owners:
+            self._remember_owner(owner)
+
+        super().clear()
+        self._touch(*owners)
+        for owner in owners:
+            self._mark_dirty(owner)
 
     def update(self, *args, **kwargs) -> None:
         items = dict(*args, **kwargs)
@@ -363,15 +748,26 @@ class Database(dict):
                 caller = self._get_write_caller()
                 if caller not in _DB_ALLOWED_WRITERS:
                     self._reject_write(owner, "<dict>", caller)
-        return super().update(items)
+        for owner, value in items.items():
+            self._remember_owner(owner, value)
+
+        super().update(items)
+        self._touch(*items)
+        for owner in items:
+            self._mark_dirty(owner)
 
     @staticmethod
     def _get_write_caller() -> typing.Optional[str]:
-        for frame_info in inspect.stack():
-            mod = frame_info.frame.f_globals.get("__name__", None)
-            if not mod or mod == __name__ or mod == f"{__package__}.pointers":
-                continue
-            return mod
+        # Walk raw frames: `inspect.stack()` would also resolve source
+        # context of every frame, which is orders of magnitude slower
+        frame = sys._getframe(1)
+        while frame is not None:
+            mod = frame.f_globals.get("__name__", None)
+            if mod and mod not in _DB_TRANSPARENT_CALLERS:
+                return mod
+
+            frame = frame.f_back
+
         return None
 
     @staticmethod
@@ -390,8 +786,14 @@ class Database(dict):
         key: str,
         default: typing.Optional[JSONSerializable] = None,
         item_type: typing.Optional[typing.Any] = None,
+        *,
+        trusted: bool = False,
     ) -> typing.Union[JSONSerializable, PointerList, PointerDict]:
-        """Get a pointer to database key"""
+        """
+        Get a pointer to database key
+        :param trusted: Write changes with `set(..., trusted=True)`. Only for
+            core code, which owns the key and puts only values it built itself
+        """
         value = self.get(owner, key, default)
         mapping = {
             list: PointerList,
@@ -416,6 +818,9 @@ class Database(dict):
                 f"Pointer for type {type(value).__name__} is not implemented"
             )
 
+        if trusted and pointer_constructor in {PointerList, PointerDict}:
+            pointer_constructor = functools.partial(pointer_constructor, trusted=True)
+
         if item_type is not None:
             if isinstance(value, list):
                 for item in self.get(owner, key, default):
@@ -15,9 +15,10 @@
 import asyncio
 import collections
 import contextlib
-import copy
 import inspect
+import itertools
 import logging
+import operator
 import re
 import sys
 import traceback
@@ -29,9 +30,10 @@ from herokutl.errors import FloodWaitError, RPCError
 from herokutl.tl.types import Message
 
 from . import loader, main, security, utils
+from ._internal import logging_client
 from .database import Database
 from .loader import Modules
-from .tl_cache import CustomTelegramClient
+from .tl_cache import CustomTelegramClient, hashable
 
 logger = logging.getLogger(__name__)
 
@@ -43,50 +45,265 @@ _LAYOUT_TRANSLATION = str.maketrans(
     + 'ёйцукенгшщзхъфывапролджэячсмитьбю.Ё"№;%:?ЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭ/ЯЧСМИТЬБЮ,',
 )
 
-ALL_TAGS = [
-    "no_commands",
-    "only_commands",
-    "out",
-    "in",
-    "only_messages",
-    "editable",
-    "no_media",
-    "only_media",
+
+def _freeze(values: typing.Iterable) -> typing.FrozenSet:
+    try:
+        return frozenset(values)
+    except TypeError:
+        return frozenset(value for value in values if hashable(value))
+
+
+class _CommandFilters:
+    """Dispatching settings, compiled from database into constant-time lookups"""
+
+    __slots__ = (
+        "prefix",
+        "prefixes",
+        "translated",
+        "blacklist_chats",
+        "whitelist_chats",
+        "whitelist_modules",
+        "nonickcmds",
+        "nonickusers",
+        "nonickchats",
+        "no_nickname",
+        "grep",
+    )
+
+    def __init__(self, db: Database):
+        self.prefix = db.get(main.__name__, "command_prefix", ".")
+        self.prefixes = dict(db.get(main.__name__, "command_prefixes", {}))
+        self.translated = {
+            prefix: str.translate(prefix, _LAYOUT_TRANSLATION)
+            for prefix in {self.prefix, *self.prefixes.values()}
+        }
+        self.blacklist_chats = _freeze(db.get(main.__name__, "blacklist_chats", []))
+        self.whitelist_chats = _freeze(db.get(main.__name__, "whitelist_chats", []))
+        self.whitelist_modules = _freeze(
+            db.get(main.__name__, "whitelist_modules", [])
+        )
+        self.nonickcmds = _freeze(db.get(main.__name__, "nonickcmds", []))
+        self.nonickusers = _freeze(db.get(main.__name__, "nonickusers", []))
+        self.nonickchats = _freeze(db.get(main.__name__, "nonickchats", []))
+        self.no_nickname = db.get(main.__name__, "no_nickname", False)
+        self.grep = db.get(main.__name__, "grep", False)
+
+    def get_prefix(self, initiator: int, me: int) -> str:
+        if initiator == me:
+            return self.prefix
+
+        return self.prefixes.get(str(initiator), self.prefix)
+
+    def is_chat_blocked(self, chat_id: int) -> bool:
+        return chat_id in self.blacklist_chats or bool(
+            self.whitelist_chats and chat_id not in self.whitelist_chats
+        )
+
+    def is_module_blocked(self, chat_id: int, module: str) -> bool:
+        if not self.blacklist_chats and not self.whitelist_modules:
+            return False
+
+        key = f"{chat_id}.{module}"
+        return key in self.blacklist_chats or bool(
+            self.whitelist_modules and key not in self.whitelist_modules
+        )
+
+
+# Properties of event, which watchers are indexed by:
+# (is message, out, private, is group, is channel, has media)
+_WatcherKey = typing.Tuple[bool, bool, bool, bool, bool, bool]
+_WATCHER_KEYS: typing.Tuple[_WatcherKey, ...] = tuple(
+    key
+    for key in itertools.product((False, True), repeat=6)
+    if key[0] or not key[5]
+)
+_MEDIA_TAGS = (
     "only_photos",
     "only_videos",
     "only_audios",
-    "only_docs",
     "only_stickers",
-    "only_inline",
-    "only_channels",
-    "only_groups",
-    "only_pm",
-    "no_pm",
-    "no_channels",
-    "no_groups",
-    "no_inline",
-    "no_stickers",
-    "no_docs",
-    "no_audios",
-    "no_videos",
-    "no_photos",
-    "no_forwards",
-    "no_reply",
-    "no_mention",
-    "mention",
-    "only_reply",
-    "only_forwards",
-    "startswith",
-    "endswith",
-    "contains",
-    "regex",
-    "filter",
-    "from_id",
-    "chat_id",
-    "thumb_url",
-    "alias",
-    "aliases",
-]
+    "only_docs",
+)
+
+
+def _watcher_key(m: typing.Any) -> _WatcherKey:
+    is_message = isinstance(m, Message)
+    return (
+        is_message,
+        bool(getattr(m, "out", True)),
+        bool(getattr(m, "private", False)),
+        bool(getattr(m, "is_group", False)),
+        bool(getattr(m, "is_channel", False)),
+        is_message and bool(getattr(m, "media", False)),
+    )
+
+
+class _WatcherEntry:
+    """Watcher with its settings, resolved once per index build"""
+
+    __slots__ = ("position", "func", "module", "disabled")
+
+    def __init__(self, position: int, func: callable, disabled: dict):
+        self.position = position
+        self.func = func
+        self.module = func.__self__.__module__
+        modname = str(func.__self__.__class__.strings["name"])
+        self.disabled = _freeze(disabled[modname]) if modname in disabled else None
+
+    def accepts(self, key: _WatcherKey) -> bool:
+        """
+        Check tags and disabled rules, which depend only on event key.
+        Remaining tags are checked per event
+        """
+        is_message, out, private, is_group, is_channel, has_media = key
+        func = self.func
+
+        if (
+            self.disabled
+            and is_message
+            and (
+                "*" in self.disabled
+                or "out" in self.disabled
+                and not out
+                or "in" in self.disabled
+                and out
+            )
+        ):
+            return False
+
+        static_tags = {
+            "out": out,
+            "in": not out,
+            "only_messages": is_message,
+            # `editable` is not pruned here: it treats events without `out`
+            # as incoming, while the key treats them as outgoing
+            "no_media": not has_media,
+            "only_media": has_media,
+            "only_channels": is_channel and not is_group,
+            "no_channels": not is_channel,
+            "no_groups": not is_group or private or is_channel,
+            "only_groups": is_group or not private and not is_channel,
+            "no_pm": not private,
+            "only_pm": private,
+            **{tag: has_media for tag in _MEDIA_TAGS},
+        }
+
+        return all(
+            result or not getattr(func, tag, False)
+            for tag, result in static_tags.items()
+        )
+
+    def is_disabled(self, message: typing.Any, chat_id: int) -> bool:
+        """Check disabled rules, which are not covered by event key"""
+        return bool(
+            self.disabled
+            and isinstance(message, Message)
+            and (
+                chat_id in self.disabled
+                or "only_chats" in self.disabled
+                and message.is_private
+                or "only_pm" in self.disabled
+                and not message.is_private
+            )
+        )
+
+
+class _WatcherIndex:
+    """
+    Watchers, sorted into buckets by cheap properties of event, so that tags
+    are checked only for watchers, which can possibly match it
+    """
+
+    __slots__ = ("_generic", "_by_chat", "_by_sender")
+
+    def __init__(self, watchers: typing.Iterable[callable], disabled: dict):
+        self._generic: typing.Dict[_WatcherKey, typing.List[_WatcherEntry]] = {}
+        self._by_chat: typing.Dict[int, typing.Dict[_WatcherKey, list]] = {}
+        self._by_sender: typing.Dict[int, typing.Dict[_WatcherKey, list]] = {}
+
+        for position, func in enumerate(watchers):
+            try:
+                entry = _WatcherEntry(position, func, disabled)
+            except Exception:
+                logger.debug("Can't index watcher %s", func, exc_info=True)
+                continue
+
+            buckets = self._generic
+            if (chat_id := getattr(func, "chat_id", False)) and hashable(chat_id):
+                if str(chat_id).startswith("-100"):
+                    chat_id = int(str(chat_id)[4:])
+
+                buckets = self._by_chat.setdefault(chat_id, {})
+            elif (from_id := getattr(func, "from_id", False)) and hashable(from_id):
+                buckets = self._by_sender.setdefault(from_id, {})
+
+            for key in _WATCHER_KEYS:
+                if entry.accepts(key):
+                    buckets.setdefault(key, []).append(entry)
+
+    def candidates(
+        self,
+        m: typing.Any,
+        chat_id: typing.Optional[int],
+    ) -> typing.List[_WatcherEntry]:
+        """Watchers, which can match event, in order of their registration"""
+        key = _watcher_key(m)
+        found = [
+            bucket
+            for bucket in (
+                self._generic.get(key),
+                self._by_chat.get(chat_id, {}).get(key) if self._by_chat else None,
+                (
+                    self._by_sender.get(getattr(m, "sender_id", None), {}).get(key)
+                    if self._by_sender
+                    else None
+                ),
+            )
+            if bucket
+        ]
+
+        if len(found) == 1:
+            return found[0]
+
+        return sorted(itertools.chain(*found), key=operator.attrgetter("position"))
+
+
+class _EventContext:
+    """
+    Results of processing of incoming event, shared by command dispatcher,
+    watcher dispatcher and tags, so that each step runs once per event
+    """
+
+    __slots__ = ("_message", "_censored", "_chat_id", "command", "escaped_prefix")
+
+    def __init__(self, message: typing.Any):
+        self._message = message
+        self._censored = False
+        self._chat_id = None
+        # Result of command parsing, `None` if it wasn't parsed yet
+        self.command: typing.Union[
+            None,
+            bool,
+            typing.Tuple[Message, str, str, callable],
+        ] = None
+        # Prefix of outgoing message, which escapes command, e.g. `..help`
+        self.escaped_prefix: typing.Optional[str] = None
+
+    @property
+    def message(self) -> typing.Any:
+        """Censored message. Censoring walks the whole object, so it's done once"""
+        if not self._censored:
+            self._message = utils.censor(self._message)
+            self._censored = True
+
+        return self._message
+
+    @property
+    def chat_id(self) -> int:
+        if self._chat_id is None:
+            self._chat_id = utils.get_chat_id(self.message)
+
+        return self._chat_id
 
 
 def _decrement_ratelimit(delay, data, key, severity):
@@ -131,6 +348,37 @@ class CommandDispatcher:
         self._cached_usernames.add(str(self._client.heroku_me.id))
 
         self.raw_handlers = []
+        self._filters_version = None
+        self._filters_cache: typing.Optional[_CommandFilters] = None
+        self._watcher_index_key = None
+        self._watcher_index: typing.Optional[_WatcherIndex] = None
+
+    @property
+    def _filters(self) -> _CommandFilters:
+        """Dispatching settings, which are recompiled only when they change"""
+        if (version := self._db.owner_version(main.__name__)) != self._filters_version:
+            self._filters_cache = _CommandFilters(self._db)
+            self._filters_version = version
+
+        return self._filters_cache
+
+    @property
+    def watcher_index(self) -> _WatcherIndex:
+        """Watcher index, which is rebuilt only if watchers or settings change"""
+        watchers = self._modules.watchers
+        key = (
+            watchers,
+            getattr(watchers, "version", None),
+            self._db.owner_version(main.__name__),
+        )
+        if key != self._watcher_index_key:
+            self._watcher_index = _WatcherIndex(
+                watchers,
+                self._db.get(main.__name__, "disabled_watchers", {}),
+            )
+            self._watcher_index_key = key
+
+        return self._watcher_index
 
     async def _handle_ratelimit(self, message: Message, func: callable) -> bool:
         if await self.security.check(message, security.OWNER):
@@ -262,6 +510,21 @@ class CommandDispatcher:
 
         return message
 
+    def _get_context(
+        self,
+        event: typing.Union[events.NewMessage, events.MessageDeleted],
+    ) -> _EventContext:
+        """
+        Get context of event. Telethon passes the same event object to every
+        handler of the same event type, so context is attached to it
+        """
+        if (ctx := getattr(event, "_heroku_context", None)) is None:
+            ctx = _EventContext(getattr(event, "message", event))
+            with contextlib.suppress(AttributeError):
+                event._heroku_context = ctx
+
+        return ctx
+
     async def _handle_command(
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
@@ -270,53 +533,77 @@ class CommandDispatcher:
         if not hasattr(event, "message") or not hasattr(event.message, "message"):
             return False
 
-        initiator = getattr(event, "sender_id", 0)
+        ctx = self._get_context(event)
+        if ctx.command is None:
+            # Mark command as being parsed, so that tags of command itself
+            # don't start parsing it again
+            ctx.command = False
+            ctx.command = await self._parse_command(event, ctx)
+
+        if watcher:
+            return ctx.command
+
+        if ctx.escaped_prefix is not None:
+            message = ctx.message
+            await message.edit(
+                message.message[len(ctx.escaped_prefix) :],
+                parse_mode=lambda s: (
+                    s,
+                    utils.relocate_entities(message.entities, -1, message.message)
+                    or (),
+                ),
+            )
+            return False
 
-        main_prefix = self._db.get(main.__name__, "command_prefix", ".")
-        if initiator == self._client.tg_id:
-            prefix = main_prefix
-        else:
-            prefix = self._db.get(main.__name__, "command_prefixes", {})
-            prefix = prefix.get(str(initiator), main_prefix)
+        if not ctx.command:
+            return False
 
-        message = utils.censor(event.message)
+        message, prefix, txt, func = ctx.command
 
-        if not event.message.message:
+        if self._filters.grep:
+            message = self._handle_grep(message)
+
+        return message, prefix, txt, func
+
+    async def _parse_command(
+        self,
+        event: typing.Union[events.NewMessage, events.MessageDeleted],
+        ctx: _EventContext,
+    ) -> typing.Union[bool, typing.Tuple[Message, str, str, callable]]:
+        initiator = getattr(event, "sender_id", 0)
+
+        filters = self._filters
+        prefix = filters.get_prefix(initiator, self._client.tg_id)
+        translated_prefix = filters.translated.get(prefix) or str.translate(
+            prefix, _LAYOUT_TRANSLATION
+        )
+
+        if not event.message.message or not (
+            event.message.message.startswith(prefix)
+            or event.message.message.startswith(translated_prefix)
+        ):
             return False
 
+        message = ctx.message
+
         if (
             message.out
             and len(message.message) > len(prefix) * 2
             and (
                 message.message.startswith(prefix * 2)
                 and any(s != prefix for s in message.message)
-                or message.message.startswith(
-                    str.translate(prefix * 2, _LAYOUT_TRANSLATION)
-                )
-                and any(
-                    s != str.translate(prefix, _LAYOUT_TRANSLATION)
-                    for s in message.message
-                )
+                or message.message.startswith(translated_prefix * 2)
+                and any(s != translated_prefix for s in message.message)
             )
         ):
             # Allow escaping commands using .'s
-            if not watcher:
-                await message.edit(
-                    message.message[len(prefix) :],
-                    parse_mode=lambda s: (
-                        s,
-                        utils.relocate_entities(message.entities, -1, message.message)
-                        or (),
-                    ),
-                )
+            ctx.escaped_prefix = prefix
             return False
 
         match True:
             case _ if (
-                event.message.message.startswith(
-                    str.translate(prefix, _LAYOUT_TRANSLATION)
-                )
-                and str.translate(prefix, _LAYOUT_TRANSLATION) != prefix
+                event.message.message.startswith(translated_prefix)
+                and translated_prefix != prefix
             ):
                 message.message = str.translate(message.message, _LAYOUT_TRANSLATION)
                 message.text = str.translate(message.text, _LAYOUT_TRANSLATION)
@@ -332,13 +619,7 @@ class CommandDispatcher:
         ):
             return False
 
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
-
-        if (chat_id := utils.get_chat_id(message)) in blacklist_chats or (
-            whitelist_chats and chat_id not in whitelist_chats
-        ):
+        if filters.is_chat_blocked(chat_id := ctx.chat_id):
             return False
 
         if not message.message or len(message.message.strip()) == len(prefix):
@@ -368,12 +649,11 @@ class CommandDispatcher:
             pass
         elif (
             not event.is_private
-            and not self._db.get(main.__name__, "no_nickname", False)
-            and command not in self._db.get(main.__name__, "nonickcmds", [])
-            and initiator not in self._db.get(main.__name__, "nonickusers", [])
+            and not filters.no_nickname
+            and command not in filters.nonickcmds
+            and initiator not in filters.nonickusers
             and not self.security.check_tsec(initiator, command)
-            and utils.get_chat_id(event)
-            not in self._db.get(main.__name__, "nonickchats", [])
+            and chat_id not in filters.nonickchats
         ):
             return False
 
@@ -407,19 +687,12 @@ class CommandDispatcher:
 
         message.message = prefix + txt + message.message[len(prefix + command) :]
 
-        if (
-            f"{str(chat_id)}.{func.__self__.__module__}" in blacklist_chats
-            or whitelist_modules
-            and f"{chat_id}.{func.__self__.__module__}" not in whitelist_modules
-        ):
+        if filters.is_module_blocked(chat_id, func.__self__.__module__):
             return False
 
         if await self._handle_tags(event, func):
             return False
 
-        if self._db.get(main.__name__, "grep", False) and not watcher:
-            message = self._handle_grep(message)
-
         return message, prefix, txt, func
 
     async def handle_raw(self, event: events.Raw):
@@ -527,95 +800,23 @@ class CommandDispatcher:
         :param func: The function to handle.
         :return: The reason for the tag to fail.
         """
-        m = event if isinstance(event, Message) else getattr(event, "message", event)
-
-        reverse_mapping = {
-            "out": lambda: getattr(m, "out", True),
-            "in": lambda: not getattr(m, "out", True),
-            "only_messages": lambda: isinstance(m, Message),
-            "editable": (
-                lambda: not getattr(m, "out", False)
-                and not getattr(m, "fwd_from", False)
-                and not getattr(m, "sticker", False)
-                and not getattr(m, "via_bot_id", False)
-            ),
-            "no_media": lambda: (
-                not isinstance(m, Message) or not getattr(m, "media", False)
-            ),
-            "only_media": lambda: isinstance(m, Message) and getattr(m, "media", False),
-            "only_photos": lambda: utils.mime_type(m).startswith("image/"),
-            "only_videos": lambda: utils.mime_type(m).startswith("video/"),
-            "only_audios": lambda: utils.mime_type(m).startswith("audio/"),
-            "only_stickers": lambda: getattr(m, "sticker", False),
-            "only_docs": lambda: getattr(m, "document", False),
-            "only_inline": lambda: getattr(m, "via_bot_id", False),
-            "only_channels": lambda: (
-                getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
-            ),
-            "no_channels": lambda: not getattr(m, "is_channel", False),
-            "no_groups": (
-                lambda: not getattr(m, "is_group", False)
-                or getattr(m, "private", False)
-                or getattr(m, "is_channel", False)
-            ),
-            "only_groups": (
-                lambda: getattr(m, "is_group", False)
-                or not getattr(m, "private", False)
-                and not getattr(m, "is_channel", False)
-            ),
-            "no_pm": lambda: not getattr(m, "private", False),
-            "only_pm": lambda: getattr(m, "private", False),
-            "no_inline": lambda: not getattr(m, "via_bot_id", False),
-            "no_stickers": lambda: not getattr(m, "sticker", False),
-            "no_docs": lambda: not getattr(m, "document", False),
-            "no_audios": lambda: not utils.mime_type(m).startswith("audio/"),
-            "no_videos": lambda: not utils.mime_type(m).startswith("video/"),
-            "no_photos": lambda: not utils.mime_type(m).startswith("image/"),
-            "no_forwards": lambda: not getattr(m, "fwd_from", False),
-            "no_reply": lambda: not getattr(m, "reply_to_msg_id", False),
-            "only_forwards": lambda: getattr(m, "fwd_from", False),
-            "only_reply": lambda: getattr(m, "reply_to_msg_id", False),
-            "mention": lambda: getattr(m, "mentioned", False),
-            "no_mention": lambda: not getattr(m, "mentioned", False),
-            "startswith": lambda: (
-                isinstance(m, Message) and m.raw_text.startswith(func.startswith)
-            ),
-            "endswith": lambda: (
-                isinstance(m, Message) and m.raw_text.endswith(func.endswith)
-            ),
-            "contains": lambda: isinstance(m, Message) and func.contains in m.raw_text,
-            "filter": lambda: callable(func.filter) and func.filter(m),
-            "from_id": lambda: getattr(m, "sender_id", None) == func.from_id,
-            "chat_id": lambda: utils.get_chat_id(m)
-            == (
-                func.chat_id
-                if not str(func.chat_id).startswith("-100")
-                else int(str(func.chat_id)[4:])
-            ),
-            "regex": lambda: (
-                isinstance(m, Message) and re.search(func.regex, m.raw_text)
-            ),
-        }
+        tags = loader.get_compiled_tags(func)
 
-        return (
-            "no_commands"
-            if getattr(func, "no_commands", False)
-            and await self._handle_command(event, watcher=True)
-            else (
-                "only_commands"
-                if getattr(func, "only_commands", False)
-                and not await self._handle_command(event, watcher=True)
-                else next(
-                    (
-                        tag
-                        for tag in ALL_TAGS
-                        if getattr(func, tag, False)
-                        and tag in reverse_mapping
-                        and not reverse_mapping[tag]()
-                    ),
-                    None,
-                )
-            )
+        if tags.no_commands or tags.only_commands:
+            # Command is parsed once per event and shared by all handlers
+            is_command = bool(await self._handle_command(event, watcher=True))
+
+            if tags.no_commands and is_command:
+                return "no_commands"
+
+            if tags.only_commands and not is_command:
+                return "only_commands"
+
+        if not tags.checks:
+            return None
+
+        return tags.check(
+            event if isinstance(event, Message) else getattr(event, "message", event)
         )
 
     async def handle_incoming(
@@ -623,40 +824,18 @@ class CommandDispatcher:
         event: typing.Union[events.NewMessage, events.MessageDeleted],
     ):
         """Handle all incoming messages"""
-        message = utils.censor(getattr(event, "message", event))
-
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
+        ctx = self._get_context(event)
+        message = ctx.message
+        filters = self._filters
 
-        if (chat_id := utils.get_chat_id(message)) in blacklist_chats or (
-            whitelist_chats and chat_id not in whitelist_chats
-        ):
+        if filters.is_chat_blocked(chat_id := ctx.chat_id):
             logger.debug("Message is blocklisted")
 
-        for func in self._modules.watchers:
-            bl = self._db.get(main.__name__, "disabled_watchers", {})
-            modname = str(func.__self__.__class__.strings["name"])
-
+        for entry in self.watcher_index.candidates(message, chat_id):
+            func = entry.func
             if (
-                modname in bl
-                and isinstance(message, Message)
-                and (
-                    "*" in bl[modname]
-                    or chat_id in bl[modname]
-                    or "only_chats" in bl[modname]
-                    and message.is_private
-                    or "only_pm" in bl[modname]
-                    and not message.is_private
-                    or "out" in bl[modname]
-                    and not message.out
-                    or "in" in bl[modname]
-                    and message.out
-                )
-                or f"{str(chat_id)}.{func.__self__.__module__}" in blacklist_chats
-                or whitelist_modules
-                and f"{str(chat_id)}.{func.__self__.__module__}"
-                not in whitelist_modules
+                entry.is_disabled(message, chat_id)
+                or filters.is_module_blocked(chat_id, entry.module)
                 or await self._handle_tags(event, func)
             ):
                 continue
@@ -688,9 +867,8 @@ class CommandDispatcher:
         *args,
     ):
         # Will be used to determine, which client caused logging messages
-        # parsed via inspect.stack()
-        _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-        try:
-            await loader._call_with_external_context(func, message)
-        except Exception as e:
-            await exception_handler(e, message, *args)
+        with logging_client(self.client.tg_id):
+            try:
+                await loader._call_with_external_context(func, message)
+            except Exception as e:
+                await exception_handler(e, message, *args)
@@ -14,6 +14,8 @@
 
 import asyncio
 import contextlib
+import heapq
+import itertools
 import logging
 import time
 import typing
@@ -31,7 +33,7 @@ from herokutl.tl.functions.messages import (
 from herokutl.tl.types import DialogFilter, InputPeerUser, Message
 from herokutl.utils import get_display_name
 
-from .. import utils
+from .. import main, utils
 from ..database import Database
 from ..tl_cache import CustomTelegramClient
 from ..translations import Translator
@@ -50,6 +52,88 @@ if typing.TYPE_CHECKING:
     from ..loader import Modules
 
 
+class _UnitStore(dict):
+    """
+    Inline units by id. Keeps heap of expiry deadlines, so that cleanup touches
+    only units, which are due, and evicts the oldest units above the limit
+    """
+
+    def __init__(
+        self,
+        limit: typing.Optional[int],
+        on_remove: typing.Callable[[str], None],
+    ):
+        super().__init__()
+        self.limit = limit
+        self.expired = 0
+        self.evicted = 0
+        self._deadlines: typing.List[typing.Tuple[float, str]] = []
+        self._on_remove = on_remove
+
+    def __setitem__(self, unit_id: str, unit: dict):
+        super().__setitem__(unit_id, unit)
+        if isinstance(unit, dict) and unit.get("ttl"):
+            heapq.heappush(self._deadlines, (unit["ttl"], unit_id))
+
+        if self.limit and len(self) > self.limit:
+            self._evict()
+
+    def __delitem__(self, unit_id: str):
+        super().__delitem__(unit_id)
+        self._on_remove(unit_id)
+
+    def pop(self, unit_id: str, *default):
+        if unit_id not in self:
+            return super().pop(unit_id, *default)
+
+        unit = super().pop(unit_id)
+        self._on_remove(unit_id)
+        return unit
+
+    def _evict(self):
+        # Units are kept in order of creation, so the oldest ones come first.
+        # Units, which are still being sent, are awaited by their senders
+        for unit_id in list(
+            itertools.islice(
+                (
+                    unit_id
+                    for unit_id, unit in self.items()
+                    if not isinstance(unit, dict) or "future" not in unit
+                ),
+                len(self) - self.limit,
+            )
+        ):
+            del self[unit_id]
+            self.evicted += 1
+
+    def expire(self, now: float):
+        """Remove units, which ttl is earlier than `now`"""
+        while self._deadlines and self._deadlines[0][0] < now:
+            deadline, unit_id = heapq.heappop(self._deadlines)
+            if not isinstance(unit := self.get(unit_id), dict) or not (
+                ttl := unit.get("ttl")
+            ):
+                continue
+
+            if ttl >= now:
+                # Unit was prolonged or replaced since it was scheduled
+                if ttl != deadline:
+                    heapq.heappush(self._deadlines, (ttl, unit_id))
+                continue
+
+            del self[unit_id]
+            self.expired += 1
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "live": len(self),
+            "scheduled": len(self._deadlines),
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
 class InlineManager(
     Utils,
     Events,
@@ -82,8 +166,20 @@ class InlineManager(
         self._allmodules = allmodules
         self.translator: Translator = allmodules.translator
 
-        self._units: typing.Dict[str, dict] = {}
+        self._units: typing.Dict[str, dict] = _UnitStore(
+            main.get_config_key("inline_units_limit") or 10000,
+            self._forget_unit_buttons,
+        )
         self._custom_map: typing.Dict[str, callable] = {}
+        # Callback data / switch query of unit buttons -> (unit id, button)
+        self._callback_index: typing.Dict[str, typing.Tuple[str, dict]] = {}
+        self._switch_index: typing.Dict[str, typing.Tuple[str, dict]] = {}
+        self._unit_index_keys: typing.Dict[
+            str,
+            typing.List[typing.Tuple[dict, str]],
+        ] = {}
+        # Units, which buttons were (re)generated and must be reindexed
+        self._dirty_units: typing.Set[str] = set()
         self.fsm: typing.Dict[str, str] = {}
         self._web_auth_tokens: typing.List[str] = []
         self._error_events: typing.Dict[str, asyncio.Event] = {}
@@ -105,12 +201,14 @@ class InlineManager(
     async def _cleaner(self):
         """Cleans outdated inline units"""
         while True:
-            for unit_id, unit in self._units.copy().items():
-                if (unit.get("ttl") or (time.time() + self._markup_ttl)) < time.time():
-                    del self._units[unit_id]
-
+            self._units.expire(time.time())
             await asyncio.sleep(5)
 
+    @property
+    def units_stats(self) -> typing.Dict[str, int]:
+        """Number of live inline units and units, removed by ttl or limit"""
+        return self._units.stats
+
     async def register_manager(
         self,
         after_break: bool = False,
@@ -265,70 +265,57 @@ class Events(InlineUnit):
                     )
                     continue
 
-        for unit_id, unit in self._units.copy().items():
-            for button in utils.array_sum(unit.get("buttons", [])):
-                if not isinstance(button, dict):
-                    logger.warning(
-                        "Can't process update, because of corrupted button: %s",
-                        button,
+        if found := self._find_unit_button(self._callback_index, call.data):
+            unit_id, unit, button = found
+            match True:
+                case _ if (
+                    button.get("disable_security", False)
+                    or unit.get("disable_security", False)
+                    or (
+                        unit.get("force_me", False)
+                        and call.from_user.id == self._me
                     )
-                    continue
-
-                if button.get("_callback_data") == call.data:
-                    match True:
-                        case _ if (
-                            button.get("disable_security", False)
-                            or unit.get("disable_security", False)
-                            or (
-                                unit.get("force_me", False)
-                                and call.from_user.id == self._me
-                            )
-                            or not unit.get("force_me", False)
-                            and (
-                                await self.check_inline_security(
-                                    func=unit.get(
-                                        "perms_map",
-                                        lambda: self._client.dispatcher.security._default,
-                                    )(),
-                                    user=call.from_user.id,
-                                )
-                                if "message" in unit
-                                else False
-                            )
-                        ):
-                            pass
-                        case _ if call.from_user.id not in (
-                            self._client.dispatcher.security._owner
-                            + unit.get("always_allow", [])
-                            + button.get("always_allow", [])
-                        ):
-                            await call.answer(
-                                self.translator.getkey("inline.button403")
-                            )
-                            return
-
-                    try:
-                        result = await button["callback"](
-                            (
-                                BotInlineCall
-                                if getattr(getattr(call, "message", None), "chat", None)
-                                else InlineCall
-                            )(call, self, unit_id),
-                            *button.get("args", []),
-                            **button.get("kwargs", {}),
-                        )
-                    except Exception:
-                        logger.exception("Error on running callback watcher!")
-                        await call.answer(
-                            (
-                                "Error occurred while processing request. More info in"
-                                " logs"
-                            ),
-                            show_alert=True,
+                    or not unit.get("force_me", False)
+                    and (
+                        await self.check_inline_security(
+                            func=unit.get(
+                                "perms_map",
+                                lambda: self._client.dispatcher.security._default,
+                            )(),
+                            user=call.from_user.id,
                         )
-                        return
+                        if "message" in unit
+                        else False
+                    )
+                ):
+                    pass
+                case _ if call.from_user.id not in (
+                    self._client.dispatcher.security._owner
+                    + unit.get("always_allow", [])
+                    + button.get("always_allow", [])
+                ):
+                    await call.answer(self.translator.getkey("inline.button403"))
+                    return
+
+            try:
+                result = await button["callback"](
+                    (
+                        BotInlineCall
+                        if getattr(getattr(call, "message", None), "chat", None)
+                        else InlineCall
+                    )(call, self, unit_id),
+                    *button.get("args", []),
+                    **button.get("kwargs", {}),
+                )
+            except Exception:
+                logger.exception("Error on running callback watcher!")
+                await call.answer(
+                    "Error occurred while processing request. More info in logs",
+                    show_alert=True,
+                )
+                return
 
-                    return result
+            return result
 
         if call.data in self._custom_map:
             match True:
@@ -382,41 +369,34 @@ class Events(InlineUnit):
         if not query:
             return
 
-        for unit_id, unit in self._units.items():
-            if (
-                unit_id == query
-                and "future" in unit
-                and isinstance(unit["future"], Event)
-            ):
-                unit["inline_message_id"] = chosen_inline_query.inline_message_id
-                unit["future"].set()
-                return
+        if (
+            (unit := self._units.get(query)) is not None
+            and "future" in unit
+            and isinstance(unit["future"], Event)
+        ):
+            unit["inline_message_id"] = chosen_inline_query.inline_message_id
+            unit["future"].set()
+            return
 
-        for unit_id, unit in self._units.copy().items():
-            for button in utils.array_sum(unit.get("buttons", [])):
-                if (
-                    "_switch_query" in button
-                    and "input" in button
-                    and button["_switch_query"] == query.split()[0]
-                    and chosen_inline_query.from_user.id
-                    in [self._me]
-                    + self._client.dispatcher.security._owner
-                    + unit.get("always_allow", [])
-                ):
-                    query = query.split(maxsplit=1)[1] if len(query.split()) > 1 else ""
-
-                    try:
-                        return await button["handler"](
-                            InlineCall(chosen_inline_query, self, unit_id),
-                            query,
-                            *button.get("args", []),
-                            **button.get("kwargs", {}),
-                        )
-                    except Exception:
-                        logger.exception(
-                            "Exception while running chosen query watcher!"
-                        )
-                        return
+        found = self._find_unit_button(self._switch_index, query.split()[0])
+        if found and chosen_inline_query.from_user.id in (
+            [self._me]
+            + self._client.dispatcher.security._owner
+            + found[1].get("always_allow", [])
+        ):
+            unit_id, _, button = found
+            query = query.split(maxsplit=1)[1] if len(query.split()) > 1 else ""
+
+            try:
+                return await button["handler"](
+                    InlineCall(chosen_inline_query, self, unit_id),
+                    query,
+                    *button.get("args", []),
+                    **button.get("kwargs", {}),
+                )
+            except Exception:
+                logger.exception("Exception while running chosen query watcher!")
+                return
 
     async def _query_help(self: "InlineManager", inline_query: InlineQuery):
         _help = []
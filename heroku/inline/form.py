@@ -10,7 +10,6 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
-import contextlib
 import copy
 import logging
 import os
@@ -38,6 +37,7 @@ from herokutl.extensions.html import CUSTOM_EMOJIS
 from herokutl.tl.types import Message
 
 from .. import main, utils
+from .._internal import logs_as_client
 from ..types import HerokuReplyMarkup
 from .types import InlineMessage, InlineUnit
 
@@ -67,6 +67,7 @@ class Placeholder:
 
 
 class Form(InlineUnit):
+    @logs_as_client(lambda self: self._client.tg_id)
     async def form(
         self: "InlineManager",
         text: str,
@@ -117,9 +118,6 @@ class Form(InlineUnit):
         :param silent: Whether the form must be sent silently (w/o "Opening form..." message)
         :return: If form is sent, returns :obj:`InlineMessage`, otherwise returns `False`
         """
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self._client.tg_id)  # noqa: F841
-
         if reply_markup is None:
             reply_markup = []
 
@@ -409,43 +407,39 @@ class Form(InlineUnit):
         except IndexError:
             return
 
-        for unit in self._units.copy().values():
-            for button in utils.array_sum(unit.get("buttons", [])):
-                if (
-                    "_switch_query" in button
-                    and "input" in button
-                    and button["_switch_query"] == query
-                    and inline_query.from_user.id
-                    in [self._me]
-                    + self._client.dispatcher.security._owner
-                    + unit.get("always_allow", [])
-                ):
-                    await inline_query.answer(
-                        [
-                            InlineQueryResultArticle(
-                                id=utils.rand(20),
-                                title=button["input"],
-                                description=(
-                                    self.translator.getkey("inline.keep_id").format(
-                                        random.choice(VERIFICATION_EMOJIES)
-                                    )
-                                ),
-                                input_message_content=InputTextMessageContent(
-                                    message_text=(
-                                        "🔄 <b>Transferring value to"
-                                        " userbot...</b>\n<i>This message will be"
-                                        " deleted automatically</i>"
-                                        if inline_query.from_user.id == self._me
-                                        else "🔄 <b>Transferring value to userbot...</b>"
-                                    ),
-                                    parse_mode="HTML",
-                                    disable_web_page_preview=True,
-                                ),
+        found = self._find_unit_button(self._switch_index, query)
+        if found and inline_query.from_user.id in (
+            [self._me]
+            + self._client.dispatcher.security._owner
+            + found[1].get("always_allow", [])
+        ):
+            button = found[2]
+            await inline_query.answer(
+                [
+                    InlineQueryResultArticle(
+                        id=utils.rand(20),
+                        title=button["input"],
+                        description=(
+                            self.translator.getkey("inline.keep_id").format(
+                                random.choice(VERIFICATION_EMOJIES)
                             )
-                        ],
-                        cache_time=60,
+                        ),
+                        input_message_content=InputTextMessageContent(
+                            message_text=(
+                                "🔄 <b>Transferring value to"
+                                " userbot...</b>\n<i>This message will be"
+                                " deleted automatically</i>"
+                                if inline_query.from_user.id == self._me
+                                else "🔄 <b>Transferring value to userbot...</b>"
+                            ),
+                            parse_mode="HTML",
+                            disable_web_page_preview=True,
+                        ),
                     )
-                    return
+                ],
+                cache_time=60,
+            )
+            return
 
         if (
             inline_query.query not in self._units
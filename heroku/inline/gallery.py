@@ -11,8 +11,6 @@
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
 import asyncio
-import contextlib
-import copy
 import functools
 import logging
 import os
@@ -36,6 +34,7 @@ from herokutl.extensions.html import CUSTOM_EMOJIS
 from herokutl.tl.types import Message
 
 from .. import main, utils
+from .._internal import logs_as_client
 from ..types import HerokuReplyMarkup
 from .types import InlineMessage, InlineUnit
 
@@ -59,6 +58,7 @@ class ListGalleryHelper:
 
 
 class Gallery(InlineUnit):
+    @logs_as_client(lambda self: self._client.tg_id)
     async def gallery(
         self: "InlineManager",
         message: typing.Union[Message, int],
@@ -102,9 +102,6 @@ class Gallery(InlineUnit):
         :param silent: Whether the gallery must be sent silently (w/o "Opening gallery..." message)
         :return: If gallery is sent, returns :obj:`InlineMessage`, otherwise returns `False`
         """
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self._client.tg_id)  # noqa: F841
-
         custom_buttons = self._validate_markup(custom_buttons)
 
         if not (
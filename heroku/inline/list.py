@@ -11,8 +11,6 @@
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
 import asyncio
-import contextlib
-import copy
 import functools
 import logging
 import time
@@ -32,6 +30,7 @@ from herokutl.extensions.html import CUSTOM_EMOJIS
 from herokutl.tl.types import Message
 
 from .. import main, utils
+from .._internal import logs_as_client
 from ..types import HerokuReplyMarkup
 from .types import InlineMessage, InlineUnit
 
@@ -42,6 +41,7 @@ logger = logging.getLogger(__name__)
 
 
 class List(InlineUnit):
+    @logs_as_client(lambda self: self._client.tg_id)
     async def list(
         self: "InlineManager",
         message: typing.Union[Message, int],
@@ -75,9 +75,6 @@ class List(InlineUnit):
         :param custom_buttons: Custom buttons to add above native ones
         :return: If list is sent, returns :obj:`InlineMessage`, otherwise returns `False`
         """
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self._client.tg_id)  # noqa: F841
-
         custom_buttons = self._validate_markup(custom_buttons)
 
         if not isinstance(manual_security, bool):
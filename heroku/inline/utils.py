@@ -108,11 +108,11 @@ class Utils(InlineUnit):
 
         markup = InlineKeyboardMarkup(inline_keyboard=[])
 
-        map_ = (
-            self._units[markup_obj]["buttons"]
-            if isinstance(markup_obj, str)
-            else markup_obj
-        )
+        if isinstance(markup_obj, str):
+            map_ = self._units[markup_obj]["buttons"]
+            self._dirty_units.add(markup_obj)
+        else:
+            map_ = markup_obj
 
         map_ = self._normalize_markup(map_)
 
@@ -310,6 +310,57 @@ class Utils(InlineUnit):
 
         return None
 
+    def _forget_unit_buttons(self: "InlineManager", unit_id: str):
+        """Remove buttons of unit from callback data and switch query indexes"""
+        self._dirty_units.discard(unit_id)
+        for index, key in self._unit_index_keys.pop(unit_id, ()):
+            if index.get(key, (None,))[0] == unit_id:
+                del index[key]
+
+    def _index_unit_buttons(self: "InlineManager", unit_id: str):
+        """Add buttons of unit to callback data and switch query indexes"""
+        self._forget_unit_buttons(unit_id)
+        if unit_id not in self._units:
+            return
+
+        keys = []
+        for button in utils.array_sum(self._units[unit_id].get("buttons", [])):
+            if not isinstance(button, dict):
+                logger.warning("Can't index corrupted button: %s", button)
+                continue
+
+            if data := button.get("_callback_data"):
+                self._callback_index[data] = (unit_id, button)
+                keys.append((self._callback_index, data))
+
+            if "input" in button and (query := button.get("_switch_query")):
+                self._switch_index[query] = (unit_id, button)
+                keys.append((self._switch_index, query))
+
+        self._unit_index_keys[unit_id] = keys
+
+    def _find_unit_button(
+        self: "InlineManager",
+        index: typing.Dict[str, typing.Tuple[str, dict]],
+        key: str,
+    ) -> typing.Optional[typing.Tuple[str, dict, dict]]:
+        """
+        Find button by its callback data or switch query in given index
+        :return: Unit id, unit and button or `None` if not found
+        """
+        while self._dirty_units:
+            self._index_unit_buttons(self._dirty_units.pop())
+
+        if (found := index.get(key)) is None:
+            return None
+
+        unit_id, button = found
+        if (unit := self._units.get(unit_id)) is None:
+            self._forget_unit_buttons(unit_id)
+            return None
+
+        return unit_id, unit, button
+
     def _normalize_markup(
         self: "InlineManager", reply_markup: HerokuReplyMarkup
     ) -> typing.List[typing.List[typing.Dict[str, typing.Any]]]:
@@ -401,6 +452,7 @@ class Utils(InlineUnit):
             unit = self._units[unit_id]
 
             unit["buttons"] = reply_markup
+            self._dirty_units.add(unit_id)
 
             if isinstance(force_me, bool):
                 unit["force_me"] = force_me
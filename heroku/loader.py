@@ -16,7 +16,6 @@ import asyncio
 import builtins
 import contextlib
 import contextvars
-import copy
 import hashlib
 import importlib
 import importlib.machinery
@@ -26,6 +25,7 @@ import logging
 import os
 import re
 import sys
+import time
 import typing
 from functools import wraps
 from pathlib import Path
@@ -33,8 +33,10 @@ from types import FunctionType
 from uuid import uuid4
 
 from herokutl.tl.tlobject import TLObject
+from herokutl.tl.types import Message
 
 from . import main, security, utils, validators
+from ._internal import logs_as_client
 from .database import Database
 from .inline.core import InlineManager
 from .translations import Strings, Translator
@@ -237,53 +239,87 @@ def _external_stack_info() -> (
     return False, None, None
 
 
-def _session_audit_hook(event, args):
-    if not args:
-        return
-    if event.startswith("import") or event.startswith("importlib."):
-        return
+_SESSION_SUFFIXES = (".session", ".session-journal")
+_SESSION_SUFFIXES_BYTES = tuple(suffix.encode() for suffix in _SESSION_SUFFIXES)
+# Audited events, which never carry file paths. Hook is called on every audited
+# event in the process, so these are rejected before any argument is inspected
+_PATHLESS_AUDIT_EVENTS = frozenset(
+    {
+        "array.__new__",
+        "builtins.id",
+        "builtins.input",
+        "builtins.input/result",
+        "code.__new__",
+        "compile",
+        "exec",
+        "function.__new__",
+        "time.sleep",
+    }
+)
+_PATHLESS_AUDIT_PREFIXES = (
+    "import",
+    "importlib.",
+    "gc.",
+    "marshal.",
+    "object.",
+    "pickle.",
+    "socket.",
+    "sys.",
+)
+_SCALAR_AUDIT_ARGS = (int, float, type(None))
+_session_audit_stats = {"calls": 0, "checked": 0, "time": 0.0}
 
-    def _is_session_path(value) -> bool:
-        try:
-            path = os.fspath(value)
-        except Exception:
-            return False
-        if isinstance(path, bytes):
-            try:
-                path = path.decode(errors="ignore")
-            except Exception:
-                return False
-        return isinstance(path, str) and (
-            path.endswith(".session") or path.endswith(".session-journal")
-        )
 
-    def _has_session_path(values) -> bool:
-        for value in values:
-            if isinstance(value, (list, tuple, set)):
-                if _has_session_path(value):
-                    return True
-                continue
-            if _is_session_path(value):
-                return True
+def get_session_audit_stats() -> dict:
+    """
+    Number of audited events seen by session hook, number of events, which
+    had their arguments inspected, and total time spent on inspection
+    """
+    return dict(_session_audit_stats)
+
+
+def _is_session_path(value: typing.Any) -> bool:
+    if isinstance(value, str):
+        return value.endswith(_SESSION_SUFFIXES)
+    if isinstance(value, bytes):
+        return value.endswith(_SESSION_SUFFIXES_BYTES)
+    if isinstance(value, _SCALAR_AUDIT_ARGS):
+        return False
+    try:
+        path = os.fspath(value)
+    except Exception:
         return False
+    return _is_session_path(path) if isinstance(path, (str, bytes)) else False
 
-    def _has_session_hint(values) -> bool:
-        for value in values:
-            if isinstance(value, (list, tuple, set)):
-                if _has_session_hint(value):
-                    return True
-                continue
-            if isinstance(value, str) and any(
-                value.endswith(ext) for ext in (".session", ".session-journal")
-            ):
+
+def _has_session_path(values: typing.Iterable[typing.Any]) -> bool:
+    for value in values:
+        if isinstance(value, (list, tuple, set)):
+            if _has_session_path(value):
                 return True
-        return False
+        elif _is_session_path(value):
+            return True
+    return False
 
-    if not _has_session_path(args):
-        if event.startswith("subprocess.") and _has_session_hint(args):
-            pass
-        else:
-            return
+
+def _session_audit_hook(event, args):
+    _session_audit_stats["calls"] += 1
+    if (
+        not args
+        or event in _PATHLESS_AUDIT_EVENTS
+        or event.startswith(_PATHLESS_AUDIT_PREFIXES)
+    ):
+        return
+
+    started = time.perf_counter()
+    try:
+        found = _has_session_path(args)
+    finally:
+        _session_audit_stats["checked"] += 1
+        _session_audit_stats["time"] += time.perf_counter() - started
+
+    if not found:
+        return
 
     ctx = _external_context.get()
     origin = None
@@ -455,6 +491,90 @@ class Placeholder:
     """Placeholder"""
 
 
+class _VersionedDict(dict):
+    """Dict, which counts its mutations to let consumers invalidate derived caches"""
+
+    __slots__ = ("version",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.version += 1
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def popitem(self):
+        self.version += 1
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+
+class _VersionedList(list):
+    """List, which counts its mutations to let consumers invalidate derived caches"""
+
+    __slots__ = ("version",)
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.version = 0
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.version += 1
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.version += 1
+
+    def __iadd__(self, other):
+        self.version += 1
+        return super().__iadd__(other)
+
+    def append(self, value):
+        super().append(value)
+        self.version += 1
+
+    def extend(self, values):
+        super().extend(values)
+        self.version += 1
+
+    def insert(self, index, value):
+        super().insert(index, value)
+        self.version += 1
+
+    def remove(self, value):
+        super().remove(value)
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+
 VALID_PIP_PACKAGES = re.compile(
     r"^\s*# ?requires:(?: ?)((?:{url} )*(?:{url}))\s*$".format(
         url=r"[-[\]_.~:/?#@!$&'()*+,;%<=>a-zA-Z0-9]+"
@@ -522,12 +642,8 @@ class InfiniteLoop:
     def _stop(self, *args, **kwargs):
         self._wait_for_stop.set()
 
+    @logs_as_client(lambda self: self.module_instance.allmodules.client.tg_id)
     def stop(self, *args, **kwargs):
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(  # noqa: F841
-                self.module_instance.allmodules.client.tg_id
-            )
-
         if self._task:
             logger.debug("Stopped loop for method %s", self.func)
             self._wait_for_stop = asyncio.Event()
@@ -539,12 +655,8 @@ class InfiniteLoop:
         logger.debug("Loop is not running")
         return asyncio.ensure_future(stop_placeholder())
 
+    @logs_as_client(lambda self: self.module_instance.allmodules.client.tg_id)
     def start(self, *args, **kwargs):
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(  # noqa: F841
-                self.module_instance.allmodules.client.tg_id
-            )
-
         if not self._task:
             logger.debug("Started loop for method %s", self.func)
             self._task = asyncio.ensure_future(self.actual_loop(*args, **kwargs))
@@ -692,6 +804,159 @@ def ratelimit(func: Command) -> Command:
     return func
 
 
+def _tag_chat_id(chat_id: typing.Any) -> typing.Any:
+    return chat_id if not str(chat_id).startswith("-100") else int(str(chat_id)[4:])
+
+
+def _tag_regex(pattern: typing.Any) -> typing.Callable[[typing.Any], typing.Any]:
+    try:
+        pattern = re.compile(pattern)
+    except (re.error, TypeError):
+        return lambda m: isinstance(m, Message) and re.search(pattern, m.raw_text)
+
+    return lambda m: isinstance(m, Message) and pattern.search(m.raw_text)
+
+
+# Tag -> factory of check for handler, in order of evaluation. Checks are
+# built once per handler and receive only the message
+_TAG_CHECKS: typing.Dict[
+    str,
+    typing.Callable[[Command], typing.Callable[[typing.Any], typing.Any]],
+] = {
+    "out": lambda func: lambda m: getattr(m, "out", True),
+    "in": lambda func: lambda m: not getattr(m, "out", True),
+    "only_messages": lambda func: lambda m: isinstance(m, Message),
+    "editable": lambda func: lambda m: (
+        not getattr(m, "out", False)
+        and not getattr(m, "fwd_from", False)
+        and not getattr(m, "sticker", False)
+        and not getattr(m, "via_bot_id", False)
+    ),
+    "no_media": lambda func: lambda m: (
+        not isinstance(m, Message) or not getattr(m, "media", False)
+    ),
+    "only_media": lambda func: lambda m: (
+        isinstance(m, Message) and getattr(m, "media", False)
+    ),
+    "only_photos": lambda func: lambda m: utils.mime_type(m).startswith("image/"),
+    "only_videos": lambda func: lambda m: utils.mime_type(m).startswith("video/"),
+    "only_audios": lambda func: lambda m: utils.mime_type(m).startswith("audio/"),
+    "only_docs": lambda func: lambda m: getattr(m, "document", False),
+    "only_stickers": lambda func: lambda m: getattr(m, "sticker", False),
+    "only_inline": lambda func: lambda m: getattr(m, "via_bot_id", False),
+    "only_channels": lambda func: lambda m: (
+        getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
+    ),
+    "only_groups": lambda func: lambda m: (
+        getattr(m, "is_group", False)
+        or not getattr(m, "private", False)
+        and not getattr(m, "is_channel", False)
+    ),
+    "only_pm": lambda func: lambda m: getattr(m, "private", False),
+    "no_pm": lambda func: lambda m: not getattr(m, "private", False),
+    "no_channels": lambda func: lambda m: not getattr(m, "is_channel", False),
+    "no_groups": lambda func: lambda m: (
+        not getattr(m, "is_group", False)
+        or getattr(m, "private", False)
+        or getattr(m, "is_channel", False)
+    ),
+    "no_inline": lambda func: lambda m: not getattr(m, "via_bot_id", False),
+    "no_stickers": lambda func: lambda m: not getattr(m, "sticker", False),
+    "no_docs": lambda func: lambda m: not getattr(m, "document", False),
+    "no_audios": lambda func: lambda m: (
+        not utils.mime_type(m).startswith("audio/")
+    ),
+    "no_videos": lambda func: lambda m: (
+        not utils.mime_type(m).startswith("video/")
+    ),
+    "no_photos": lambda func: lambda m: (
+        not utils.mime_type(m).startswith("image/")
+    ),
+    "no_forwards": lambda func: lambda m: not getattr(m, "fwd_from", False),
+    "no_reply": lambda func: lambda m: not getattr(m, "reply_to_msg_id", False),
+    "no_mention": lambda func: lambda m: not getattr(m, "mentioned", False),
+    "mention": lambda func: lambda m: getattr(m, "mentioned", False),
+    "only_reply": lambda func: lambda m: getattr(m, "reply_to_msg_id", False),
+    "only_forwards": lambda func: lambda m: getattr(m, "fwd_from", False),
+    "startswith": lambda func: (
+        lambda m, prefix=func.startswith: (
+            isinstance(m, Message) and m.raw_text.startswith(prefix)
+        )
+    ),
+    "endswith": lambda func: (
+        lambda m, suffix=func.endswith: (
+            isinstance(m, Message) and m.raw_text.endswith(suffix)
+        )
+    ),
+    "contains": lambda func: (
+        lambda m, part=func.contains: isinstance(m, Message) and part in m.raw_text
+    ),
+    "regex": lambda func: _tag_regex(func.regex),
+    "filter": lambda func: (
+        lambda m, check=func.filter: callable(check) and check(m)
+    ),
+    "from_id": lambda func: (
+        lambda m, from_id=func.from_id: getattr(m, "sender_id", None) == from_id
+    ),
+    "chat_id": lambda func: (
+        lambda m, chat_id=_tag_chat_id(func.chat_id): utils.get_chat_id(m) == chat_id
+    ),
+}
+
+
+class _CompiledTags(typing.NamedTuple):
+    no_commands: bool
+    only_commands: bool
+    checks: typing.Tuple[
+        typing.Tuple[str, typing.Callable[[typing.Any], typing.Any]],
+        ...,
+    ]
+
+    def check(self, m: typing.Any) -> typing.Optional[str]:
+        """Return the first tag, which message doesn't pass"""
+        for name, check in self.checks:
+            if not check(m):
+                return name
+
+        return None
+
+
+def _compile_tags(func: Command) -> _CompiledTags:
+    """Build checks for tags, which are set on handler"""
+    return _CompiledTags(
+        bool(getattr(func, "no_commands", False)),
+        bool(getattr(func, "only_commands", False)),
+        tuple(
+            (name, factory(func))
+            for name, factory in _TAG_CHECKS.items()
+            if getattr(func, name, False)
+        ),
+    )
+
+
+def refresh_compiled_tags(func: Command) -> _CompiledTags:
+    """
+    Compile checks for tags of handler and cache them on it. Called when
+    handler is registered, so tags, set after decoration, are picked up
+    """
+    compiled = _compile_tags(func)
+    with contextlib.suppress(AttributeError):
+        getattr(func, "__func__", func)._compiled_tags = compiled
+
+    return compiled
+
+
+def get_compiled_tags(func: Command) -> _CompiledTags:
+    """
+    Get checks for tags of handler. They are compiled on registration, and
+    lazily for handlers, which were not registered via `Modules`
+    """
+    if (compiled := getattr(func, "_compiled_tags", None)) is None:
+        compiled = refresh_compiled_tags(func)
+
+    return compiled
+
+
 def tag(*tags, **kwarg_tags):
     """
     Tag function (esp. watchers) with some tags
@@ -851,6 +1116,11 @@ class Modules:
         self.inline_handlers = {}
         self.callback_handlers = {}
         self.aliases = {}
+        self._routing_key = None
+        self._routing: typing.Dict[
+            str,
+            typing.Tuple[typing.Optional[str], typing.Optional[Command]],
+        ] = {}
         self.modules: typing.List[typing.Optional["Module"]] = []  # skipcq: PTC-W0052
         self.libraries = []
         self.watchers = []
@@ -867,6 +1137,30 @@ class Modules:
         self.inline = InlineManager(self.client, self._db, self)
         self.client.heroku_inline = self.inline
 
+    @property
+    def commands(self) -> typing.Dict[str, Command]:
+        return self._commands
+
+    @commands.setter
+    def commands(self, value: typing.Dict[str, Command]):
+        self._commands = _VersionedDict(value)
+
+    @property
+    def watchers(self) -> typing.List[callable]:
+        return self._watchers
+
+    @watchers.setter
+    def watchers(self, value: typing.List[callable]):
+        self._watchers = _VersionedList(value)
+
+    @property
+    def aliases(self) -> typing.Dict[str, str]:
+        return self._aliases
+
+    @aliases.setter
+    def aliases(self, value: typing.Dict[str, str]):
+        self._aliases = _VersionedDict(value)
+
     async def _junk_collector(self):
         """
         Periodically reloads commands, inline handlers, callback handlers and watchers from loaded
@@ -944,14 +1238,12 @@ class Modules:
 
         return loaded
 
+    @logs_as_client(lambda self: self.client.tg_id)
     async def _register_modules(
         self,
         modules: list,
         origin: str = "<core>",
     ) -> typing.List[Module]:
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         loaded = []
 
         for mod in modules:
@@ -978,6 +1270,7 @@ class Modules:
 
         return loaded
 
+    @logs_as_client(lambda self: self.client.tg_id)
     async def register_module(
         self,
         spec: importlib.machinery.ModuleSpec,
@@ -986,9 +1279,6 @@ class Modules:
         save_fs: bool = False,
     ) -> Module:
         """Register single module from importlib spec"""
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         module = importlib.util.module_from_spec(spec)
         sys.modules[module_name] = module
 
@@ -1092,7 +1382,9 @@ class Modules:
             if hasattr(spec.loader, "data")
             else inspect.getsource(ret.__class__)
         )
-        ret.__module_hash__ = _calc_module_hash(ret.__source__)
+        ret.__module_hash__ = getattr(
+            spec.loader, "source_hash", None
+        ) or _calc_module_hash(ret.__source__)
         _MODULE_NAME_BY_HASH[ret.__module_hash__] = ret.__class__.__name__
 
         return ret
@@ -1121,11 +1413,9 @@ class Modules:
 
         return self._db.get(main.__name__, "remove_core_protection", False)
 
+    @logs_as_client(lambda self: self.client.tg_id)
     def register_commands(self, instance: Module):
         """Register commands from instance"""
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         if instance.__origin__.startswith("<core"):
             self._core_commands += list(
                 map(lambda x: x.lower(), list(instance.heroku_commands))
@@ -1143,6 +1433,7 @@ class Modules:
 
                 raise CoreOverwriteError(command=_command)
 
+            refresh_compiled_tags(cmd)
             self.commands.update({_command.lower(): cmd})
 
         for alias, cmd in self.aliases.copy().items():
@@ -1223,17 +1514,16 @@ class Modules:
                     purpose,
                 )
 
+    @logs_as_client(lambda self: self.client.tg_id)
     def register_watchers(self, instance: Module):
         """Register watcher from instance"""
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         for _watcher in self.watchers:
             if _watcher.__self__.__class__.__name__ == instance.__class__.__name__:
                 logger.debug("Removing watcher %s for update", _watcher)
                 self.watchers.remove(_watcher)
 
         for _watcher in instance.heroku_watchers.values():
+            refresh_compiled_tags(_watcher)
             self.watchers += [_watcher]
 
     def lookup(
@@ -1284,11 +1574,9 @@ class Modules:
 
         return set(prefixes)
 
+    @logs_as_client(lambda self: self.client.tg_id)
     async def complete_registration(self, instance: Module):
         """Complete registration of instance"""
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         internalized = []
         try:
             internalized = self._db.get("HerokuPluginSecurity", "internalized", [])
@@ -1376,19 +1664,10 @@ class Modules:
             return None
 
         for command_name, _command in self.commands.items():
-            aliases = []
-            if getattr(_command, "alias", None) and not (
-                aliases := getattr(_command, "aliases", None)
-            ):
-                aliases = [_command.alias]
-
-            if not aliases:
-                continue
-
             if any(
                 alias.lower() == _alias.lower()
                 and alias.lower() not in self._core_commands
-                for _alias in aliases
+                for _alias in self._get_command_aliases(_command)
             ):
                 return command_name
 
@@ -1397,61 +1676,115 @@ class Modules:
 
         return None
 
-    def dispatch(self, _command: str) -> typing.Tuple[str, typing.Optional[str]]:
-        """Dispatch command to appropriate module"""
-
-        resolved = next(
-            (
-                (cmd, self.commands[cmd.split()[0].lower()])
-                for cmd in [
-                    _command,
-                    self.aliases.get(_command.lower()),
-                    self.find_alias(_command),
-                ]
-                if cmd and cmd.split()[0].lower() in self.commands
-            ),
-            (_command, None),
-        )
+    @staticmethod
+    def _get_command_aliases(_command: Command) -> typing.List[str]:
+        aliases = []
+        if getattr(_command, "alias", None) and not (
+            aliases := getattr(_command, "aliases", None)
+        ):
+            aliases = [_command.alias]
 
-        cmd, func = resolved
-        if not func:
-            return resolved
+        return aliases or []
 
+    def _build_routing(
+        self,
+    ) -> typing.Dict[str, typing.Tuple[typing.Optional[str], typing.Optional[Command]]]:
+        """
+        Compile commands, legacy aliases and decorator aliases into a single
+        lowercase name -> (replacement, handler) mapping. Replacement is `None`
+        for commands themselves. Disabled commands are compiled with `None` handler
+        """
         try:
-            disabled_modules = self._db.get(main.__name__, "disabled_modules", [])
-            disabled_commands = self._db.get(main.__name__, "disabled_commands", {})
+            disabled_modules = set(
+                self._db.get(main.__name__, "disabled_modules", [])
+            )
+            disabled_commands = {
+                module: {x.lower() for x in commands}
+                for module, commands in self._db.get(
+                    main.__name__, "disabled_commands", {}
+                ).items()
+            }
         except Exception:
-            disabled_modules = []
+            disabled_modules = set()
             disabled_commands = {}
 
-        module_name = None
-        try:
-            module_name = func.__self__.__class__.__name__
-        except Exception:
-            module_name = None
+        def compile_entry(name: str, cmd: typing.Optional[str], func: Command):
+            try:
+                module_name = func.__self__.__class__.__name__
+            except Exception:
+                module_name = None
+
+            if module_name and (
+                module_name in disabled_modules
+                or (cmd or name).split()[0].lower()
+                in disabled_commands.get(module_name, ())
+            ):
+                return (cmd, None)
+
+            return (cmd, func)
 
-        if module_name and module_name in disabled_modules:
+        routing = {}
+
+        for command_name, _command in self.commands.items():
+            for _alias in self._get_command_aliases(_command):
+                if (name := _alias.lower()) not in self._core_commands:
+                    routing.setdefault(
+                        name,
+                        compile_entry(name, command_name, _command),
+                    )
+
+        for name, cmd in self.aliases.items():
+            if cmd and (func := self.commands.get(cmd.split()[0].lower())):
+                routing[name] = compile_entry(name, cmd, func)
+
+        for name, func in self.commands.items():
+            routing[name] = compile_entry(name, None, func)
+
+        return routing
+
+    @property
+    def routing(
+        self,
+    ) -> typing.Dict[str, typing.Tuple[typing.Optional[str], typing.Optional[Command]]]:
+        """Compiled routing table, which is rebuilt only if commands or settings change"""
+        key = (
+            self._commands,
+            self._commands.version,
+            self._aliases,
+            self._aliases.version,
+            self._db.owner_version(main.__name__),
+        )
+        if key != self._routing_key:
+            self._routing = self._build_routing()
+            self._routing_key = key
+
+        return self._routing
+
+    def dispatch(self, _command: str) -> typing.Tuple[str, typing.Optional[str]]:
+        """Dispatch command to appropriate module"""
+        if not (words := _command.split(maxsplit=1)):
             return (_command, None)
 
-        if module_name and module_name in disabled_commands:
-            disabled_for_mod = [
-                x.lower() for x in disabled_commands.get(module_name, [])
-            ]
-            if cmd.split()[0].lower() in disabled_for_mod:
-                return (_command, None)
+        if words[0] == _command:
+            entry = self.routing.get(_command.lower())
+        elif (entry := self.routing.get(words[0].lower())) and entry[0] is not None:
+            # Only commands themselves can be dispatched with trailing arguments
+            entry = None
+
+        if not entry or not entry[1]:
+            return (_command, None)
 
-        return (cmd, func)
+        cmd, func = entry
+        return (cmd or _command, func)
 
     def send_config(self, skip_hook: bool = False):
         """Configure modules"""
         for mod in self.modules:
             self.send_config_one(mod, skip_hook)
 
+    @logs_as_client(lambda self: self.client.tg_id)
     def send_config_one(self, mod: Module, skip_hook: bool = False):
         """Send config to single instance"""
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         if hasattr(mod, "config"):
             modcfg = self._db.get(
                 mod.__class__.__name__,
@@ -1509,14 +1842,13 @@ class Modules:
             *[self.send_ready_one_wrapper(mod) for mod in self.modules]
         )
 
+    @logs_as_client(lambda self: self.client.tg_id)
     async def send_ready_one(
         self,
         mod: Module,
         no_self_unload: bool = False,
         from_dlmod: bool = False,
     ):
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
         origin = getattr(mod, "__origin__", "")
         safe_client = (
             mod.client
@@ -1615,13 +1947,11 @@ class Modules:
             name,
         )
 
+    @logs_as_client(lambda self: self.client.tg_id)
     async def unload_module(self, classname: str) -> typing.List[str]:
         """Remove module and all stuff from it"""
         worked = []
 
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         for module in self.modules:
             if classname.lower() in (
                 module.name.lower(),
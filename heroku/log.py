@@ -13,14 +13,18 @@
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
 import asyncio
+import collections
 import contextlib
 import git
 import inspect
 import io
+import itertools
 import linecache
 import logging
+import operator
 import re
 import sys
+import time
 import traceback
 import typing
 import os
@@ -37,6 +41,7 @@ from . import utils
 from ._internal import (
     get_branch_name,
     check_commit_ancestor,
+    logging_client_id,
     reset_to_master,
     restore_worktree,
     restart,
@@ -50,6 +55,17 @@ INTERNET_ERRORS = (
     ServerError,
     PersistentTimestampOutdatedError,
 )
+# Bot API allows about 20 messages per minute to the same group
+TG_SEND_RATE = 20 / 60
+TG_SEND_BURST = 3
+TG_MESSAGE_LIMIT = 4096
+# Records, waiting to be sent to log chat, per calling client. Records above
+# this limit are dropped and reported to the chat later
+TG_QUEUE_LIMIT = 200
+# Exceptions with traceback button, sent to one client per sender run
+TG_EXCEPTIONS_PER_TICK = 5
+TG_TOPIC_TTL = 60
+
 old = linecache.getlines
 
 
@@ -238,28 +254,81 @@ class HerokuException:
         )
 
 
+class LogEntry(typing.NamedTuple):
+    """Compact copy of log record, kept in memory for `.logs`"""
+
+    levelno: int
+    created: float
+    client_id: typing.Optional[int]
+    text: str
+
+
+class _TokenBucket:
+    """Allows `rate` actions per second on average, with bursts of `burst`"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst,
+            self._tokens + (now - self._updated) * self.rate,
+        )
+        self._updated = now
+
+    def drain(self):
+        """Spend all tokens, e.g. when server asked to slow down"""
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+
+    async def acquire(self):
+        self._refill()
+        while self._tokens < 1:
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._refill()
+
+        self._tokens -= 1
+
+
 class TelegramLogsHandler(logging.Handler):
     """
-    Keeps 2 buffers.
-    One for dispatched messages.
-    One for unused messages.
-    When the length of the 2 together is 100
-    truncate to make them 100 together,
-    first trimming handled then unused.
+    Keeps 2 ring buffers of `capacity` records each, so that the oldest
+    record is dropped in O(1) once buffer is full.
+    One for formatted entries of all records, which are shown by `.logs`.
+    One for records, which are not passed to targets yet, because their level
+    is below handler level. They are passed once record of higher level arrives
     """
 
     def __init__(self, targets: list, capacity: int):
         super().__init__(0)
-        self.buffer = []
-        self.handledbuffer = []
-        self._queue = []
+        self._capacity = capacity
+        self.buffer: typing.Deque[logging.LogRecord] = collections.deque(
+            maxlen=capacity
+        )
+        self.entries: typing.Deque[LogEntry] = collections.deque(maxlen=capacity)
         self._mods = {}
-        self.tg_buff = []
+        # Records to be sent to log chats, keyed by client which caused them.
+        # `None` stands for records, which are sent to every client
+        self._tg_queues: typing.Dict[
+            typing.Optional[int],
+            typing.Deque[typing.Tuple[int, typing.Union[str, HerokuException]]],
+        ] = collections.defaultdict(collections.deque)
+        self._tg_seq = itertools.count()
+        self.tg_dropped: typing.Counter[typing.Optional[int]] = collections.Counter()
+        self._tg_dropped_reported = collections.Counter()
+        self._buckets: typing.Dict[int, _TokenBucket] = {}
+        self._topic_ids: typing.Dict[
+            int,
+            typing.Tuple[float, typing.Optional[int]],
+        ] = {}
         self.force_send_all = False
         self.tg_level = 20
         self.ignore_common = False
         self.targets = targets
-        self.capacity = capacity
         self.lvl = logging.NOTSET
         self._send_lock = asyncio.Lock()
 
@@ -268,6 +337,7 @@ class TelegramLogsHandler(logging.Handler):
             self._task.cancel()
 
         self._mods[mod.tg_id] = mod
+        self._topic_ids.pop(mod.tg_id, None)
 
         self._task = asyncio.ensure_future(self.queue_poller())
 
@@ -280,9 +350,39 @@ class TelegramLogsHandler(logging.Handler):
     def setLevel(self, level: int):
         self.lvl = level
 
-    def dump(self):
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, value: int):
+        self.acquire()
+        try:
+            self._capacity = value
+            self.buffer = collections.deque(self.buffer, maxlen=value)
+            self.entries = collections.deque(self.entries, maxlen=value)
+        finally:
+            self.release()
+
+    def clear(self):
+        """Drop all stored records"""
+        self.acquire()
+        try:
+            self.buffer.clear()
+            self.entries.clear()
+        finally:
+            self.release()
+
+        for queue in list(self._tg_queues.values()):
+            queue.clear()
+
+    def dump(self) -> typing.List[LogEntry]:
         """Return a list of logging entries"""
-        return self.handledbuffer + self.buffer
+        self.acquire()
+        try:
+            return list(self.entries)
+        finally:
+            self.release()
 
     def dumps(
         self,
@@ -290,12 +390,18 @@ class TelegramLogsHandler(logging.Handler):
         client_id: typing.Optional[int] = None,
     ) -> typing.List[str]:
         """Return all entries of minimum level as list of strings"""
-        return [
-            self.targets[0].format(record)
-            for record in (self.buffer + self.handledbuffer)
-            if record.levelno >= lvl
-            and (not record.heroku_caller or client_id == record.heroku_caller)
-        ]
+        # Records are appended under the same lock from other threads, so ring
+        # buffer is iterated in place, without taking a copy of it
+        self.acquire()
+        try:
+            return [
+                entry.text
+                for entry in self.entries
+                if entry.levelno >= lvl
+                and (not entry.client_id or client_id == entry.client_id)
+            ]
+        finally:
+            self.release()
 
     async def _show_full_trace(
         self,
@@ -324,136 +430,190 @@ class TelegramLogsHandler(logging.Handler):
         return self._mods[client_id].logchat
 
     async def get_logs_topic_id_by_client(self, client_id: int) -> typing.Optional[int]:
-        """Get logs topic ID from database"""
+        """Get logs topic ID from database. Result is cached for a while"""
+        if (cached := self._topic_ids.get(client_id)) and (
+            time.monotonic() - cached[0] < TG_TOPIC_TTL
+        ):
+            return cached[1]
+
         try:
             db = self._mods[client_id].db
             topic_id = await utils.get_topic_id(db, "Logs")
-            return topic_id
         except Exception:
             logging.exception("Failed to get logs topic ID")
             return None
 
+        self._topic_ids[client_id] = (time.monotonic(), topic_id)
+        return topic_id
+
+    def _drain(self, caller: typing.Optional[int]) -> list:
+        """
+        Take all queued items of caller. Text records are split into parts,
+        which fit in a message, and escaped once for all clients
+        """
+        queue = self._tg_queues[caller]
+        items = []
+        while True:
+            try:
+                seq, item = queue.popleft()
+            except IndexError:
+                break
+
+            if isinstance(item, str):
+                items += [
+                    (seq, (part, utils.escape_html(part)))
+                    for part in utils.chunks(item, TG_MESSAGE_LIMIT)
+                ]
+            else:
+                items.append((seq, item))
+
+        return items
+
+    @staticmethod
+    def _coalesce(parts: typing.List[typing.Tuple[str, str]]) -> typing.List[str]:
+        """Join escaped text parts into as few messages as possible"""
+        chunks, current, size = [], [], 0
+        for raw, escaped in parts:
+            if current and size + len(raw) > TG_MESSAGE_LIMIT:
+                chunks.append("".join(current))
+                current, size = [], 0
+
+            current.append(escaped)
+            size += len(raw)
+
+        if current:
+            chunks.append("".join(current))
+
+        return chunks
+
     async def sender(self):
         async with self._send_lock:
-            self._queue = {
-                client_id: utils.chunks(
-                    utils.escape_html(
-                        "".join(
-                            [
-                                item[0]
-                                for item in self.tg_buff
-                                if isinstance(item[0], str)
-                                and (
-                                    not item[1]
-                                    or item[1] == client_id
-                                    or self.force_send_all
-                                )
-                            ]
-                        )
-                    ),
-                    4096,
-                )
-                for client_id in self._mods
+            pending = {caller: self._drain(caller) for caller in list(self._tg_queues)}
+            dropped = {
+                caller: self.tg_dropped[caller] - self._tg_dropped_reported[caller]
+                for caller in list(self.tg_dropped)
             }
-
-            self._exc_queue = {}
-            for client_id in self._mods:
-                try:
-                    topic_id = await self.get_logs_topic_id_by_client(client_id)
-                except Exception:
-                    topic_id = None
-
-                funcs = []
-                for item in self.tg_buff:
-                    if not isinstance(item[0], HerokuException):
-                        continue
-                    if not (not item[1] or item[1] == client_id or self.force_send_all):
-                        continue
-                    if isinstance(item[0].sysinfo[1], INTERNET_ERRORS) and getattr(
-                        self._mods[client_id].lookup("tester"), "config", {}
-                    ).get("disable_internet_warn", False):
-                        continue
-
-                    funcs.append(
-                        functools.partial(
-                            self._mods[client_id].inline.bot.send_message,
-                            self._mods[client_id].logchat,
-                            item[0].message,
-                            reply_markup=self._mods[client_id].inline.generate_markup(
-                                [
-                                    {
-                                        "text": "🪐 Full traceback",
-                                        "callback": self._show_full_trace,
-                                        "args": (
-                                            self._mods[client_id].inline.bot,
-                                            item[0],
-                                        ),
-                                        "disable_security": True,
-                                    },
-                                ],
-                            ),
-                            message_thread_id=topic_id,
-                        )
+            self._tg_dropped_reported.update(dropped)
+
+            shipments = []
+            for client_id in list(self._mods):
+                callers = (
+                    pending.keys() | dropped.keys()
+                    if self.force_send_all
+                    else {None, client_id}
+                )
+                items = sorted(
+                    (item for caller in callers for item in pending.get(caller, ())),
+                    key=operator.itemgetter(0),
+                )
+                shipments.append(
+                    self._ship(
+                        client_id,
+                        [item for _, item in items],
+                        sum(dropped.get(caller, 0) for caller in callers),
                     )
+                )
+
+            await asyncio.gather(*shipments)
 
-                self._exc_queue[client_id] = funcs
+    async def _ship(self, client_id: int, items: list, dropped: int):
+        """Send items, queued for client, to its log chat"""
+        if not items and not dropped:
+            return
+
+        mod = self._mods[client_id]
+        topic_id = await self.get_logs_topic_id_by_client(client_id)
+        bucket = self._buckets.setdefault(
+            client_id,
+            _TokenBucket(TG_SEND_RATE, TG_SEND_BURST),
+        )
 
-            await asyncio.gather(
-                *(
-                    self._exc_sender(*exceptions)
-                    for exceptions in self._exc_queue.values()
+        exceptions = [
+            item
+            for item in items
+            if isinstance(item, HerokuException)
+            and not (
+                isinstance(item.sysinfo[1], INTERNET_ERRORS)
+                and getattr(mod.lookup("tester"), "config", {}).get(
+                    "disable_internet_warn", False
                 )
             )
+        ]
+        if len(exceptions) > TG_EXCEPTIONS_PER_TICK:
+            dropped += len(exceptions) - TG_EXCEPTIONS_PER_TICK
+            exceptions = exceptions[:TG_EXCEPTIONS_PER_TICK]
+
+        parts = [item for item in items if isinstance(item, tuple)]
+        if dropped:
+            notice = f"⚠️ {dropped} log records were dropped due to flood\n"
+            parts.append((notice, notice))
+
+        funcs = [
+            functools.partial(
+                mod.inline.bot.send_message,
+                mod.logchat,
+                exc.message,
+                reply_markup=mod.inline.generate_markup(
+                    [
+                        {
+                            "text": "🪐 Full traceback",
+                            "callback": self._show_full_trace,
+                            "args": (mod.inline.bot, exc),
+                            "disable_security": True,
+                        },
+                    ],
+                ),
+                message_thread_id=topic_id,
+            )
+            for exc in exceptions
+        ]
 
-            self.tg_buff = []
+        chunks = self._coalesce(parts)
+        if len(chunks) > 5:
+            logfile = io.BytesIO("".join(raw for raw, _ in parts).encode("utf-8"))
+            logfile.name = "heroku-logs.txt"
+            logfile.seek(0)
+            funcs.append(
+                functools.partial(
+                    mod.inline.bot.send_document,
+                    mod.logchat,
+                    logfile,
+                    caption=(
+                        "<b>🧳 Journals are too big to be sent as separate"
+                        " messages</b>"
+                    ),
+                    message_thread_id=topic_id,
+                )
+            )
+        else:
+            funcs += [
+                functools.partial(
+                    mod.inline.bot.send_message,
+                    mod.logchat,
+                    f"<code>{chunk}</code>",
+                    disable_notification=True,
+                    message_thread_id=topic_id,
+                )
+                for chunk in chunks
+            ]
 
-            for client_id in self._mods:
-                if client_id not in self._queue:
-                    continue
+        await self._deliver(bucket, *funcs)
 
-                if len(self._queue[client_id]) > 5:
-                    logfile = io.BytesIO(
-                        "".join(self._queue[client_id]).encode("utf-8")
-                    )
-                    logfile.name = "heroku-logs.txt"
-                    logfile.seek(0)
-                    await self._mods[client_id].inline.bot.send_document(
-                        self._mods[client_id].logchat,
-                        logfile,
-                        caption=(
-                            "<b>🧳 Journals are too big to be sent as separate"
-                            " messages</b>"
-                        ),
-                        message_thread_id=await self.get_logs_topic_id_by_client(
-                            client_id
-                        ),
-                    )
-
-                    self._queue[client_id] = []
-                    continue
-
-                while self._queue[client_id]:
-                    if chunk := self._queue[client_id].pop(0):
-                        asyncio.ensure_future(
-                            self._mods[client_id].inline.bot.send_message(
-                                self._mods[client_id].logchat,
-                                f"<code>{chunk}</code>",
-                                disable_notification=True,
-                                message_thread_id=await self.get_logs_topic_id_by_client(
-                                    client_id
-                                ),
-                            )
-                        )
-
-    async def _exc_sender(self, *funcs: typing.Callable[..., Coroutine]):
+    async def _deliver(
+        self,
+        bucket: "_TokenBucket",
+        *funcs: typing.Callable[..., Coroutine],
+    ):
         for func in funcs:
             attempt = 0
             while attempt < 2:
+                await bucket.acquire()
                 try:
                     await func()
                     break
                 except TelegramRetryAfter as e:
                     attempt += 1
+                    bucket.drain()
                     await asyncio.sleep(e.retry_after)
                 except RuntimeError:
                     logging.debug(
@@ -464,90 +624,70 @@ class TelegramLogsHandler(logging.Handler):
                 except Exception:
                     logging.debug("Failed to send log message", exc_info=True)
                     break
-            if attempt > 2:
-                logging.debug(
-                    "Failed to send log message after retries, skipping",
-                    exc_info=True,
-                )
+            else:
+                logging.debug("Failed to send log message after retries, skipping")
 
-    def emit(self, record: logging.LogRecord):
-        try:
-            caller = next(
-                (
-                    frame_info.frame.f_locals["_heroku_client_id_logging_tag"]
-                    for frame_info in inspect.stack()
-                    if isinstance(
-                        getattr(getattr(frame_info, "frame", None), "f_locals", {}).get(
-                            "_heroku_client_id_logging_tag"
-                        ),
-                        int,
-                    )
-                ),
-                False,
+    def _enqueue_tg(self, record: logging.LogRecord, caller: typing.Optional[int]):
+        queue = self._tg_queues[caller]
+        if len(queue) >= TG_QUEUE_LIMIT:
+            # Drop before formatting, so that crash loop costs almost nothing
+            self.tg_dropped[caller] += 1
+            return
+
+        if record.exc_info:
+            try:
+                if record.args:
+                    comment = record.msg % record.args
+                else:
+                    comment = str(record.msg)
+            except Exception:
+                comment = f"{record.msg} {record.args}"
+
+            exc = HerokuException.from_exc_info(
+                *record.exc_info,
+                stack=record.__dict__.get("stack", None),
+                comment=comment,
             )
 
-            if not isinstance(caller, int):
-                caller = None
-        except Exception:
-            caller = None
+            if not self.ignore_common or all(
+                field not in exc.message
+                for field in [
+                    "InputPeerEmpty() does not have any entity type",
+                    "https://docs.telethon.dev/en/stable/concepts/entities.html",
+                ]
+            ):
+                queue.append((next(self._tg_seq), exc))
+        else:
+            queue.append((next(self._tg_seq), _tg_formatter.format(record)))
 
+    def emit(self, record: logging.LogRecord):
+        caller = logging_client_id.get()
         record.heroku_caller = caller
 
         if record.levelno >= self.tg_level:
-            if record.exc_info:
-                try:
-                    if record.args:
-                        comment = record.msg % record.args
-                    else:
-                        comment = str(record.msg)
-                except Exception:
-                    comment = f"{record.msg} {record.args}"
+            self._enqueue_tg(record, caller)
 
-                exc = HerokuException.from_exc_info(
-                    *record.exc_info,
-                    stack=record.__dict__.get("stack", None),
-                    comment=comment,
+        self.acquire()
+        try:
+            self.entries.append(
+                LogEntry(
+                    record.levelno,
+                    record.created,
+                    caller,
+                    self.targets[0].format(record),
                 )
+            )
+            self.buffer.append(record)
 
-                if not self.ignore_common or all(
-                    field not in exc.message
-                    for field in [
-                        "InputPeerEmpty() does not have any entity type",
-                        "https://docs.telethon.dev/en/stable/concepts/entities.html",
-                    ]
-                ):
-                    self.tg_buff += [(exc, caller)]
-            else:
-                self.tg_buff += [
-                    (
-                        _tg_formatter.format(record),
-                        caller,
-                    )
-                ]
-
-        if len(self.buffer) + len(self.handledbuffer) >= self.capacity:
-            if self.handledbuffer:
-                del self.handledbuffer[0]
-            else:
-                del self.buffer[0]
-
-        self.buffer.append(record)
-
-        if record.levelno >= self.lvl >= 0:
-            self.acquire()
-            try:
+            if record.levelno >= self.lvl >= 0:
                 for precord in self.buffer:
                     for target in self.targets:
                         if record.levelno >= target.level:
                             target.handle(precord)
 
-                self.handledbuffer = (
-                    self.handledbuffer[-(self.capacity - len(self.buffer)) :]
-                    + self.buffer
-                )
-                self.buffer = []
-            finally:
-                self.release()
+                self.buffer.clear()
+        finally:
+            self.release()
 
 
 async def check_branch(me_id: int, allowed_ids: list, self):
@@ -1217,6 +1217,12 @@ class Heroku:
 
     async def _shutdown_handler(self):
         for client in self.clients:
+            if (db := getattr(client, "heroku_db", None)) is not None:
+                try:
+                    await db.flush()
+                except Exception:
+                    logging.exception("Failed to flush database on shutdown")
+
             inline = getattr(client.loader, "inline", None)
             if inline:
                 for t in (inline._task, inline._cleaner_task):
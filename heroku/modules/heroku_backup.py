@@ -138,6 +138,7 @@ class HerokuBackupMod(loader.Module):
                 self.get("last_backup") + self.get("period") - time.time()
             )
 
+            self._db.load_all()
             db = io.BytesIO(
                 orjson.dumps(
                     self._db, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
@@ -287,6 +288,7 @@ class HerokuBackupMod(loader.Module):
 
     @loader.command()
     async def backupdb(self, message: Message):
+        self._db.load_all()
         txt = io.BytesIO(
             orjson.dumps(self._db, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
         )
@@ -484,6 +486,7 @@ class HerokuBackupMod(loader.Module):
 
     @loader.command()
     async def backupall(self, message: Message):
+        self._db.load_all()
         db = io.BytesIO(
             orjson.dumps(self._db, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
         )
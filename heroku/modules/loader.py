@@ -14,6 +14,7 @@
 
 import ast
 import asyncio
+import collections
 import contextlib
 import difflib
 import functools
@@ -39,7 +40,7 @@ from herokutl.tl.functions.channels import JoinChannelRequest
 from herokutl.tl.types import Channel, Message
 
 from .. import loader, main, utils
-from .._local_storage import RemoteStorage
+from .._local_storage import DEFAULT_FETCH_CONCURRENCY, RemoteStorage
 from ..compat import geek
 from ..inline.types import InlineCall
 from ..types import CoreOverwriteError, CoreUnloadError
@@ -97,6 +98,12 @@ class LoaderMod(loader.Module):
                     loader.validators.RegExp(r"^.*:.*$")
                 ),
             ),
+            loader.ConfigValue(
+                "download_concurrency",
+                DEFAULT_FETCH_CONCURRENCY,
+                lambda: self.strings("download_concurrency_doc"),
+                validator=loader.validators.Integer(minimum=1, maximum=32),
+            ),
             loader.ConfigValue(
                 "command_emoji",
                 "<tg-emoji emoji-id=5197195523794157505>▫️</tg-emoji>",
@@ -136,37 +143,36 @@ class LoaderMod(loader.Module):
 
     @loader.loop(interval=3, wait_before=True, autostart=True)
     async def _config_autosaver(self):
-        for mod in self.allmodules.modules:
-            if (
-                not hasattr(mod, "config")
-                or not mod.config
-                or not isinstance(mod.config, loader.ModuleConfig)
-            ):
-                continue
-
-            for option, config in mod.config._config.items():
-                if not hasattr(config, "_save_marker"):
-                    continue
+        if not (queue := loader.ConfigValue._save_queue):
+            return
 
-                delattr(mod.config._config[option], "_save_marker")
-                mod.pointer("__config__", {})[option] = config.value
+        pointers = {
+            id(mod.config): functools.partial(mod.pointer, "__config__", {})
+            for mod in self.allmodules.modules
+            if isinstance(getattr(mod, "config", None), loader.ModuleConfig)
+        }
+        pointers.update(
+            {
+                id(lib.config): functools.partial(lib._lib_pointer, "__config__", {})
+                for lib in self.allmodules.libraries
+                if isinstance(getattr(lib, "config", None), loader.ModuleConfig)
+            }
+        )
 
-        for lib in self.allmodules.libraries:
-            if (
-                not hasattr(lib, "config")
-                or not lib.config
-                or not isinstance(lib.config, loader.ModuleConfig)
-            ):
+        saved = False
+        for key, config in list(queue.items()):
+            # Values of other clients' modules are saved by their loaders
+            if (module_config := getattr(config, "_module_config", None)) is None or (
+                pointer := pointers.get(id(module_config))
+            ) is None:
                 continue
 
-            for option, config in lib.config._config.items():
-                if not hasattr(config, "_save_marker"):
-                    continue
-
-                delattr(lib.config._config[option], "_save_marker")
-                lib._lib_pointer("__config__", {})[option] = config.value
+            queue.pop(key, None)
+            pointer()[config.option] = config.value
+            saved = True
 
-        self._db.save()
+        if saved:
+            self._db.save()
 
     def update_modules_in_db(self):
         if self.allmodules.secure_boot:
@@ -316,6 +322,23 @@ class LoaderMod(loader.Module):
             False,
         )
 
+    async def _resolve_url(
+        self,
+        module_name: str,
+    ) -> typing.Tuple[typing.Union[str, bool], bool]:
+        """Turns module name or link into raw download url and `blob_link` flag"""
+        if not urlparse(module_name).netloc:
+            return await self._find_link(module_name), False
+
+        if re.match(
+            r"^(https:\/\/github\.com\/.*?\/.*?\/blob\/.*\.py)|"
+            r"(https:\/\/gitlab\.com\/.*?\/.*?\/-\/blob\/.*\.py)$",
+            module_name,
+        ):
+            return module_name.replace("/blob/", "/raw/"), True
+
+        return module_name, False
+
     async def download_and_install(
         self,
         module_name: str,
@@ -323,25 +346,14 @@ class LoaderMod(loader.Module):
         force_pm: bool = False,
     ) -> int:
         try:
-            blob_link = False
             module_name = module_name.strip()
-            if urlparse(module_name).netloc:
-                url = module_name
-                if re.match(
-                    r"^(https:\/\/github\.com\/.*?\/.*?\/blob\/.*\.py)|"
-                    r"(https:\/\/gitlab\.com\/.*?\/.*?\/-\/blob\/.*\.py)$",
-                    url,
-                ):
-                    url = url.replace("/blob/", "/raw/")
-                    blob_link = True
-            else:
-                url = await self._find_link(module_name)
+            url, blob_link = await self._resolve_url(module_name)
 
-                if not url:
-                    if message is not None:
-                        await utils.answer(message, self.strings("no_module"))
+            if not url:
+                if message is not None:
+                    await utils.answer(message, self.strings("no_module"))
 
-                    return MODULE_LOADING_FAILED
+                return MODULE_LOADING_FAILED
 
             if message:
                 message = await utils.answer(
@@ -531,6 +543,7 @@ class LoaderMod(loader.Module):
         blob_link: bool = False,
         did_requires: bool = False,
         did_packages: bool = False,
+        timings: typing.Optional[collections.Counter] = None,
     ):
         if any(
             line.replace(" ", "") == "#scope:ffmpeg" for line in doc.splitlines()
@@ -599,6 +612,7 @@ class LoaderMod(loader.Module):
 
                 kwargs = utils.get_kwargs()
                 kwargs["did_requires"] = True
+                kwargs["timings"] = timings
 
                 return await self.load_module(**kwargs)  # Try again
 
@@ -629,6 +643,7 @@ class LoaderMod(loader.Module):
 
                 kwargs = utils.get_kwargs()
                 kwargs["did_packages"] = True
+                kwargs["timings"] = timings
 
                 return await self.load_module(**kwargs)
 
@@ -695,12 +710,21 @@ class LoaderMod(loader.Module):
                     loader.StringLoader(doc, f"<external {module_name}>"),
                     origin=f"<external {module_name}>",
                 )
-                instance = await self.allmodules.register_module(
-                    spec,
-                    module_name,
-                    origin,
-                    save_fs=save_fs,
-                )
+                started = time.perf_counter()
+                try:
+                    instance = await self.allmodules.register_module(
+                        spec,
+                        module_name,
+                        origin,
+                        save_fs=save_fs,
+                    )
+                finally:
+                    if timings is not None:
+                        compile_time = spec.loader.compile_time
+                        timings["compile"] += compile_time
+                        timings["register"] += (
+                            time.perf_counter() - started - compile_time
+                        )
             except ImportError as e:
                 logger.info(
                     "Module loading failed, attemping dependency installation (%s)",
@@ -753,6 +777,7 @@ class LoaderMod(loader.Module):
 
                 kwargs = utils.get_kwargs()
                 kwargs["did_requirements"] = True
+                kwargs["timings"] = timings
 
                 return await self.load_module(**kwargs)  # Try again
             except CoreOverwriteError as e:
@@ -830,11 +855,17 @@ class LoaderMod(loader.Module):
                         await asyncio.sleep(0.1)
 
                 task = asyncio.ensure_future(inner_proxy())
-                await self.allmodules.send_ready_one(
-                    instance,
-                    no_self_unload=True,
-                    from_dlmod=bool(message),
-                )
+                started = time.perf_counter()
+                try:
+                    await self.allmodules.send_ready_one(
+                        instance,
+                        no_self_unload=True,
+                        from_dlmod=bool(message),
+                    )
+                finally:
+                    if timings is not None:
+                        timings["client_ready"] += time.perf_counter() - started
+
                 task.cancel()
             except CoreOverwriteError as e:
                 await core_overwrite(e)
@@ -943,7 +974,7 @@ class LoaderMod(loader.Module):
                 if (
                     developer in self._client.heroku_entity_cache
                     and getattr(
-                        await self._client.get_entity(developer),
+                        await self._client.get_entity(developer, copy=False),
                         "left",
                         True,
                     )
@@ -957,7 +988,8 @@ class LoaderMod(loader.Module):
             developer_entity = None
 
         if message is None:
-            return
+            # Lets startup installer tell loaded modules from failed ones
+            return True
 
         modhelp = []
         mod_doc = ""
@@ -1330,8 +1362,7 @@ class LoaderMod(loader.Module):
             self._db.set(loader.__name__, "secure_boot", False)
             self._secure_boot = True
         else:
-            for mod in todo.values():
-                await self.download_and_install(mod)
+            await self._install_startup_modules(list(todo.values()))
 
             self.update_modules_in_db()
 
@@ -1348,6 +1379,75 @@ class LoaderMod(loader.Module):
         with contextlib.suppress(AttributeError):
             await self.lookup("Updater").full_restart_complete(self._secure_boot)
 
+    async def _install_startup_modules(self, modules: typing.List[str]):
+        """
+        Downloads all modules concurrently, then loads them one by one in the
+        original order, so that registration stays deterministic
+        """
+        timings = collections.Counter()
+        installed = 0
+        started = time.perf_counter()
+
+        resolved = []
+        for module_name in map(str.strip, modules):
+            try:
+                url, blob_link = await self._resolve_url(module_name)
+            except Exception:
+                logger.exception("Failed to resolve %s", module_name)
+                continue
+
+            if not url:
+                logger.warning("Module %s not found in repos", module_name)
+                continue
+
+            resolved.append((module_name, url, blob_link))
+
+        fetch_started = time.perf_counter()
+        sources = await self._storage.fetch_many(
+            [url for _, url, _ in resolved],
+            auth=self.config["basic_auth"],
+            limit=self.config["download_concurrency"],
+        )
+        timings["fetch"] = time.perf_counter() - fetch_started
+
+        for (module_name, url, blob_link), source in zip(resolved, sources):
+            if isinstance(source, Exception):
+                logger.error(
+                    "Failed to download %s",
+                    module_name,
+                    exc_info=(
+                        None
+                        if isinstance(source, requests.exceptions.HTTPError)
+                        else source
+                    ),
+                )
+                continue
+
+            try:
+                if await self.load_module(
+                    source,
+                    None,
+                    module_name,
+                    url,
+                    blob_link=blob_link,
+                    timings=timings,
+                ):
+                    installed += 1
+            except Exception:
+                logger.exception("Failed to load %s", module_name)
+
+        logger.info(
+            "Installed %s/%s external modules in %.2fs (fetch: %.2fs, compile: %.2fs,"
+            " register: %.2fs, client_ready: %.2fs)",
+            installed,
+            len(modules),
+            time.perf_counter() - started,
+            timings["fetch"],
+            timings["compile"],
+            timings["register"],
+            timings["client_ready"],
+        )
+
     def flush_cache(self) -> int:
         """Flush the cache of links to modules"""
         count = sum(map(len, self._links_cache.values()))
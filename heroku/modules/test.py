@@ -25,6 +25,7 @@ from herokutl.types import InputMediaWebPage
 
 from .. import loader, main, utils
 from ..inline.types import InlineCall
+from ..log import TelegramLogsHandler
 
 logger = logging.getLogger(__name__)
 
@@ -147,9 +148,8 @@ class TestMod(loader.Module):
     @loader.command()
     async def clearlogs(self, message: Message):
         for handler in logging.getLogger().handlers:
-            handler.buffer = []
-            handler.handledbuffer = []
-            handler.tg_buff = ""
+            if isinstance(handler, TelegramLogsHandler):
+                handler.clear()
 
         await utils.answer(message, self.strings("logs_cleared"))
 
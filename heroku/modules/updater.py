@@ -346,6 +346,9 @@ class UpdaterMod(loader.Module):
 
         self.set("restart_ts", time.time())
 
+        # Delayed writes won't be done, as process is replaced on restart
+        await self._db.flush()
+
         with contextlib.suppress(Exception):
             await main.heroku.web.stop()
 
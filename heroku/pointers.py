@@ -22,11 +22,14 @@ class PointerList(list):
         module: str,
         key: str,
         default: typing.Optional[typing.Any] = None,
+        *,
+        trusted: bool = False,
     ):
         self._db = db
         self._module = module
         self._key = key
         self._default = default
+        self._trusted = trusted
         super().__init__(db.get(module, key, default))
 
     @property
@@ -95,7 +98,7 @@ class PointerList(list):
         self._save()
 
     def _save(self):
-        self._db.set(self._module, self._key, list(self))
+        self._db.set(self._module, self._key, list(self), trusted=self._trusted)
 
     def tolist(self):
         return self._db.get(self._module, self._key, self._default)
@@ -110,11 +113,14 @@ class PointerDict(dict):
         module: str,
         key: str,
         default: typing.Optional[typing.Any] = None,
+        *,
+        trusted: bool = False,
     ):
         self._db = db
         self._module = module
         self._key = key
         self._default = default
+        self._trusted = trusted
         super().__init__(db.get(module, key, default))
 
     @property
@@ -168,7 +174,7 @@ class PointerDict(dict):
         self._save()
 
     def _save(self):
-        self._db.set(self._module, self._key, dict(self))
+        self._db.set(self._module, self._key, dict(self), trusted=self._trusted)
 
     def todict(self):
         return self._db.get(self._module, self._key, self._default)
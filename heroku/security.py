@@ -164,10 +164,16 @@ class SecurityManager:
 
         self._any_admin = self.any_admin = db.get(__name__, "any_admin", False)
         self._default = self.default = db.get(__name__, "default", DEFAULT_PERMISSIONS)
-        self._tsec_chat = self.tsec_chat = db.pointer(__name__, "tsec_chat", [])
-        self._tsec_user = self.tsec_user = db.pointer(__name__, "tsec_user", [])
-        self._owner = self.owner = db.pointer(__name__, "owner", [])
-        self._all_users = self.all_users = db.pointer(__name__, "all_users", [])
+        self._tsec_chat = self.tsec_chat = db.pointer(
+            __name__, "tsec_chat", [], trusted=True
+        )
+        self._tsec_user = self.tsec_user = db.pointer(
+            __name__, "tsec_user", [], trusted=True
+        )
+        self._owner = self.owner = db.pointer(__name__, "owner", [], trusted=True)
+        self._all_users = self.all_users = db.pointer(
+            __name__, "all_users", [], trusted=True
+        )
 
         self._reload_rights()
 
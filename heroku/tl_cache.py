@@ -10,10 +10,12 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import collections
 import copy
-import inspect
 import logging
+import sys
 import time
+import types
 import typing
 
 from herokutl import TelegramClient
@@ -27,7 +29,7 @@ from herokutl.tl import functions
 from herokutl.tl.alltlobjects import LAYER
 from herokutl.tl.functions.channels import GetFullChannelRequest
 from herokutl.tl.functions.users import GetFullUserRequest
-from herokutl.tl.tlobject import TLRequest
+from herokutl.tl.tlobject import TLObject, TLRequest
 from herokutl.tl.types import (
     ChannelFull,
     Message,
@@ -39,6 +41,8 @@ from herokutl.tl.types import (
 )
 from herokutl.utils import is_list_like
 
+from . import main
+from ._internal import logs_as_client
 from .types import (
     CacheRecordEntity,
     CacheRecordFullChannel,
@@ -71,31 +75,328 @@ def hashable(value: typing.Any) -> bool:
     return True
 
 
+# Cache type -> (max number of records, seconds after which records are dropped).
+# Can be overriden with `tl_cache` key in config.json, e.g.
+# `{"tl_cache": {"entity": {"maxsize": 10000, "ttl": 600}}}`
+DEFAULT_CACHE_LIMITS = {
+    "entity": (5000, 60 * 60),
+    "perms": (5000, 60 * 60),
+    "fullchannel": (500, 60 * 60),
+    "fulluser": (1000, 60 * 60),
+}
+
+
+class TLCache(collections.abc.MutableMapping):
+    """
+    Mapping of cache records with least-recently-used eviction once it grows
+    over `maxsize`. Records older than `ttl` are swept out periodically on
+    writes, instead of staying in memory until they are looked up again
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._records: typing.OrderedDict[typing.Hashable, typing.Any] = (
+            collections.OrderedDict()
+        )
+        self._next_sweep = time.time() + min(ttl, 60)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __getitem__(self, key: typing.Hashable) -> typing.Any:
+        record = self._records[key]
+        self._records.move_to_end(key)
+        return record
+
+    def __setitem__(self, key: typing.Hashable, record: typing.Any):
+        self._records[key] = record
+        self._records.move_to_end(key)
+
+        if self._next_sweep < time.time():
+            self.sweep()
+
+        while len(self._records) > self.maxsize:
+            self._records.popitem(last=False)
+            self.evictions += 1
+
+    def __delitem__(self, key: typing.Hashable):
+        del self._records[key]
+
+    def __contains__(self, key: typing.Any) -> bool:
+        return key in self._records
+
+    def __iter__(self) -> typing.Iterator[typing.Hashable]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def clear(self):
+        self._records.clear()
+
+    def lookup(
+        self,
+        key: typing.Hashable,
+        max_age: typing.Optional[int] = None,
+        strict: bool = False,
+    ) -> typing.Optional[typing.Any]:
+        """
+        Get record and count cache hit or miss
+        :param key: Key of the record
+        :param max_age: Maximum age of the record in seconds. Any age, if `None`
+        :param strict: Also treat records, expired on their own, as missing
+        :return: Record or `None`, if it is missing or too old
+        """
+        record = self._records.get(key)
+        if (
+            record is None
+            or (max_age is not None and record.ts + max_age <= time.time())
+            or (strict and record.expired)
+        ):
+            self.misses += 1
+            return None
+
+        self._records.move_to_end(key)
+        self.hits += 1
+        return record
+
+    def sweep(self) -> int:
+        """Drop records, which are older than `ttl`"""
+        deadline = time.time() - self.ttl
+        expired = [key for key, record in self._records.items() if record.ts < deadline]
+        for key in expired:
+            del self._records[key]
+
+        self.expirations += len(expired)
+        self._next_sweep = time.time() + min(self.ttl, 60)
+        return len(expired)
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "size": len(self._records),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class _CachedList(list):
+    """
+    List attribute of cached object, seen through the view. Items are read
+    from it directly, and any change copies the viewed object first and is
+    applied to the private copy, so that it stays on the view
+    """
+
+    __slots__ = ("_view", "_name")
+
+    def __init__(self, view: "CachedView", name: str, items: typing.Iterable):
+        super().__init__(items)
+        self._view = view
+        self._name = name
+
+    def _mutate(self, method: str, *args) -> typing.Any:
+        target = getattr(self._view._detach(), self._name)
+        result = getattr(target, method)(*args)
+        # Mirror the private copy, so that caller keeps seeing actual contents
+        list.clear(self)
+        list.extend(self, target)
+        return result
+
+    def append(self, *args):
+        return self._mutate("append", *args)
+
+    def extend(self, *args):
+        return self._mutate("extend", *args)
+
+    def insert(self, *args):
+        return self._mutate("insert", *args)
+
+    def remove(self, *args):
+        return self._mutate("remove", *args)
+
+    def pop(self, *args):
+        return self._mutate("pop", *args)
+
+    def clear(self):
+        return self._mutate("clear")
+
+    def sort(self, *args, **kwargs):
+        target = getattr(self._view._detach(), self._name)
+        target.sort(*args, **kwargs)
+        list.clear(self)
+        list.extend(self, target)
+
+    def reverse(self):
+        return self._mutate("reverse")
+
+    def __setitem__(self, *args):
+        return self._mutate("__setitem__", *args)
+
+    def __delitem__(self, *args):
+        return self._mutate("__delitem__", *args)
+
+    def __iadd__(self, other: typing.Iterable) -> "_CachedList":
+        self._mutate("extend", other)
+        return self
+
+    def __imul__(self, other: int) -> "_CachedList":
+        self._mutate("__imul__", other)
+        return self
+
+
+class CachedView:
+    """
+    Read-only view of cached object, which is shared between callers.
+    Attributes are read from cached object directly, and nested TL objects
+    are wrapped into views as well. Once caller writes to the view, cached
+    object (or the nested part of it) is copied, so the cache is never changed
+    """
+
+    __slots__ = (
+        "_view_target",
+        "_view_parent",
+        "_view_path",
+        "_view_owned",
+        "_view_lists",
+    )
+
+    def __init__(
+        self,
+        target: typing.Any,
+        parent: typing.Optional["CachedView"] = None,
+        path: typing.Tuple[str, typing.Optional[int]] = ("", None),
+    ):
+        object.__setattr__(self, "_view_target", target)
+        object.__setattr__(self, "_view_parent", parent)
+        object.__setattr__(self, "_view_path", path)
+        object.__setattr__(self, "_view_owned", False)
+        # Attribute name -> wrapped list, so that the same list is returned
+        # on every access
+        object.__setattr__(self, "_view_lists", {})
+
+    @property
+    def __class__(self) -> type:
+        # Makes `isinstance` and `match` work as with the cached object itself
+        return type(object.__getattribute__(self, "_view_target"))
+
+    def _wrap(self, name: str, value: typing.Any) -> typing.Any:
+        if isinstance(value, TLObject):
+            return CachedView(value, self, (name, None))
+
+        if isinstance(value, list):
+            if (wrapped := self._view_lists.get(name)) is None:
+                wrapped = self._view_lists[name] = _CachedList(
+                    self,
+                    name,
+                    (
+                        (
+                            CachedView(item, self, (name, index))
+                            if isinstance(item, TLObject)
+                            else item
+                        )
+                        for index, item in enumerate(value)
+                    ),
+                )
+
+            return wrapped
+
+        return value
+
+    def _detach(self) -> typing.Any:
+        """Replace viewed object with a private copy and return it"""
+        if self._view_owned:
+            return self._view_target
+
+        if self._view_parent is None:
+            target = copy.deepcopy(self._view_target)
+        else:
+            name, index = self._view_path
+            target = getattr(self._view_parent._detach(), name)
+            if index is not None:
+                target = target[index]
+
+        object.__setattr__(self, "_view_target", target)
+        object.__setattr__(self, "_view_owned", True)
+        return target
+
+    def __getattr__(self, name: str) -> typing.Any:
+        if name == "__dict__":
+            # Caller may change attributes through it, so it's never shared
+            return self._detach().__dict__
+
+        value = getattr(self._view_target, name)
+        return value if self._view_owned else self._wrap(name, value)
+
+    def __setattr__(self, name: str, value: typing.Any):
+        if isinstance(value, _CachedList):
+            # E.g. `view.items += [...]`, which was already applied
+            value = list(value)
+
+        setattr(self._detach(), name, value)
+
+    def __delattr__(self, name: str):
+        delattr(self._detach(), name)
+
+    def __eq__(self, other: typing.Any) -> bool:
+        if isinstance(other, CachedView):
+            other = object.__getattribute__(other, "_view_target")
+
+        return self._view_target == other
+
+    def __ne__(self, other: typing.Any) -> bool:
+        return not self == other
+
+    def __hash__(self) -> int:
+        return hash(self._view_target)
+
+    def __bool__(self) -> bool:
+        return bool(self._view_target)
+
+    def __str__(self) -> str:
+        return str(self._view_target)
+
+    def __repr__(self) -> str:
+        return repr(self._view_target)
+
+    def __bytes__(self) -> bytes:
+        return bytes(self._view_target)
+
+    def __copy__(self) -> typing.Any:
+        return copy.copy(self._view_target)
+
+    def __deepcopy__(self, memo: dict) -> typing.Any:
+        return copy.deepcopy(self._view_target, memo)
+
+
+def _view(value: typing.Any, copy: bool) -> typing.Any:
+    return CachedView(value) if copy and value is not None else value
+
+
 class CustomTelegramClient(TelegramClient):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._heroku_entity_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordEntity,
-        ] = {}
+        limits = main.get_config_key("tl_cache") or {}
 
-        self._heroku_perms_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordPerms,
-        ] = {}
+        def make_cache(name: str) -> TLCache:
+            maxsize, ttl = DEFAULT_CACHE_LIMITS[name]
+            config = limits.get(name, {}) if isinstance(limits, dict) else {}
+            return TLCache(config.get("maxsize", maxsize), config.get("ttl", ttl))
 
-        self._heroku_fullchannel_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullChannel,
-        ] = {}
+        # Entity id, username or @username -> record
+        self._heroku_entity_cache: TLCache = make_cache("entity")
+        # (entity key, user key) -> record
+        self._heroku_perms_cache: TLCache = make_cache("perms")
+        self._heroku_fullchannel_cache: TLCache = make_cache("fullchannel")
+        self._heroku_fulluser_cache: TLCache = make_cache("fulluser")
 
-        self._heroku_fulluser_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullUser,
-        ] = {}
-
-        self._forbidden_constructors: typing.List[int] = []
+        self._forbidden_constructors: typing.FrozenSet[int] = frozenset()
 
         self._raw_updates_processor: typing.Optional[
             typing.Callable[
@@ -215,23 +516,33 @@ class CustomTelegramClient(TelegramClient):
         self._raw_updates_processor = value
 
     @property
-    def heroku_entity_cache(self) -> typing.Dict[int, CacheRecordEntity]:
+    def heroku_entity_cache(self) -> TLCache:
         return self._heroku_entity_cache
 
     @property
-    def heroku_perms_cache(self) -> typing.Dict[int, CacheRecordPerms]:
+    def heroku_perms_cache(self) -> TLCache:
         return self._heroku_perms_cache
 
     @property
-    def heroku_fullchannel_cache(self) -> typing.Dict[int, CacheRecordFullChannel]:
+    def heroku_fullchannel_cache(self) -> TLCache:
         return self._heroku_fullchannel_cache
 
     @property
-    def heroku_fulluser_cache(self) -> typing.Dict[int, CacheRecordFullUser]:
+    def heroku_fulluser_cache(self) -> TLCache:
         return self._heroku_fulluser_cache
 
     @property
-    def forbidden_constructors(self) -> typing.List[str]:
+    def heroku_cache_stats(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """Size, limits and hit/miss/eviction counters of each cache"""
+        return {
+            "entity": self._heroku_entity_cache.stats,
+            "perms": self._heroku_perms_cache.stats,
+            "fullchannel": self._heroku_fullchannel_cache.stats,
+            "fulluser": self._heroku_fulluser_cache.stats,
+        }
+
+    @property
+    def forbidden_constructors(self) -> typing.FrozenSet[int]:
         return self._forbidden_constructors
 
     async def force_get_entity(self, *args, **kwargs):
@@ -239,11 +550,13 @@ class CustomTelegramClient(TelegramClient):
 
         return await self.get_entity(*args, force=True, **kwargs)
 
+    @logs_as_client(lambda self: self.tg_id)
     async def get_entity(
         self,
         entity: EntityLike,
         exp: int = 5 * 60,
         force: bool = False,
+        copy: bool = True,
     ):
         """
         Gets the entity and cache it
@@ -251,13 +564,11 @@ class CustomTelegramClient(TelegramClient):
         :param entity: Entity to fetch
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param copy: Whether to protect cached entity from changes. If `False`, cached
+            object itself is returned, so it must not be modified
         :return: :obj:`Entity`
         """
 
-        # Will be used to determine, which client caused logging messages
-        # parsed via inspect.stack()
-        _heroku_client_id_logging_tag = copy.copy(self.tg_id)  # noqa: F841
-
         if not hashable(entity):
             try:
                 hashable_entity = next(
@@ -280,18 +591,16 @@ class CustomTelegramClient(TelegramClient):
         if (
             not force
             and hashable_entity
-            and hashable_entity in self._heroku_entity_cache
             and (
-                not exp
-                or self._heroku_entity_cache[hashable_entity].ts + exp > time.time()
+                record := self._heroku_entity_cache.lookup(hashable_entity, exp or None)
             )
         ):
             logger.debug(
                 "Using cached entity %s (%s)",
                 entity,
-                type(self._heroku_entity_cache[hashable_entity].entity).__name__,
+                type(record.entity).__name__,
             )
-            return copy.deepcopy(self._heroku_entity_cache[hashable_entity].entity)
+            return _view(record.entity, copy)
 
         resolved_entity = await super().get_entity(entity)
 
@@ -312,14 +621,17 @@ class CustomTelegramClient(TelegramClient):
                 self._heroku_entity_cache[f"@{resolved_entity.username}"] = cache_record
                 self._heroku_entity_cache[resolved_entity.username] = cache_record
 
-        return copy.deepcopy(resolved_entity)
+        # Cache record holds its own copy, so resolved entity is given away as is
+        return resolved_entity
 
+    @logs_as_client(lambda self: self.tg_id)
     async def get_perms_cached(
         self,
         entity: EntityLike,
         user: typing.Optional[EntityLike] = None,
         exp: int = 5 * 60,
         force: bool = False,
+        copy: bool = True,
     ):
         """
         Gets the permissions of the user in the entity and cache it
@@ -328,15 +640,13 @@ class CustomTelegramClient(TelegramClient):
         :param user: User to fetch
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param copy: Whether to protect cached permissions from changes. If `False`,
+            cached object itself is returned, so it must not be modified
         :return: :obj:`ChatPermissions`
         """
 
-        # Will be used to determine, which client caused logging messages
-        # parsed via inspect.stack()
-        _heroku_client_id_logging_tag = copy.copy(self.tg_id)  # noqa: F841
-
-        entity = await self.get_entity(entity)
-        user = await self.get_entity(user) if user else None
+        entity = await self.get_entity(entity, copy=False)
+        user = await self.get_entity(user, copy=False) if user else None
 
         if not hashable(entity) or not hashable(user):
             try:
@@ -378,17 +688,15 @@ class CustomTelegramClient(TelegramClient):
             not force
             and hashable_entity
             and hashable_user
-            and hashable_user in self._heroku_perms_cache.get(hashable_entity, {})
             and (
-                not exp
-                or self._heroku_perms_cache[hashable_entity][hashable_user].ts + exp
-                > time.time()
+                record := self._heroku_perms_cache.lookup(
+                    (hashable_entity, hashable_user),
+                    exp or None,
+                )
             )
         ):
             logger.debug("Using cached perms %s (%s)", hashable_entity, hashable_user)
-            return copy.deepcopy(
-                self._heroku_perms_cache[hashable_entity][hashable_user].perms
-            )
+            return _view(record.perms, copy)
 
         resolved_perms = await self.get_permissions(entity, user)
 
@@ -399,23 +707,17 @@ class CustomTelegramClient(TelegramClient):
                 resolved_perms,
                 exp,
             )
-            self._heroku_perms_cache.setdefault(hashable_entity, {})[
-                hashable_user
-            ] = cache_record
+            self._heroku_perms_cache[(hashable_entity, hashable_user)] = cache_record
             logger.debug("Saved hashable_entity %s perms to cache", hashable_entity)
 
             def save_user(key: typing.Union[str, int]):
                 nonlocal self, cache_record, user, hashable_user
                 if getattr(user, "id", None):
-                    self._heroku_perms_cache.setdefault(key, {})[user.id] = cache_record
+                    self._heroku_perms_cache[(key, user.id)] = cache_record
 
                 if getattr(user, "username", None):
-                    self._heroku_perms_cache.setdefault(key, {})[
-                        f"@{user.username}"
-                    ] = cache_record
-                    self._heroku_perms_cache.setdefault(key, {})[
-                        user.username
-                    ] = cache_record
+                    self._heroku_perms_cache[(key, f"@{user.username}")] = cache_record
+                    self._heroku_perms_cache[(key, user.username)] = cache_record
 
             if getattr(entity, "id", None):
                 logger.debug("Saved resolved_entity id %s perms to cache", entity.id)
@@ -429,7 +731,7 @@ class CustomTelegramClient(TelegramClient):
                 save_user(f"@{entity.username}")
                 save_user(entity.username)
 
-        return copy.deepcopy(resolved_perms)
+        return resolved_perms
 
     async def get_fullchannel(
         self,
@@ -467,13 +769,14 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and self._heroku_fullchannel_cache.get(hashable_entity)
-            and not self._heroku_fullchannel_cache[hashable_entity].expired
-            and self._heroku_fullchannel_cache[hashable_entity].ts + exp > time.time()
+        if not force and (
+            record := self._heroku_fullchannel_cache.lookup(
+                hashable_entity,
+                exp,
+                strict=True,
+            )
         ):
-            return self._heroku_fullchannel_cache[hashable_entity].full_channel
+            return record.full_channel
 
         result = await self(GetFullChannelRequest(channel=entity))
         self._heroku_fullchannel_cache[hashable_entity] = CacheRecordFullChannel(
@@ -519,13 +822,14 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and self._heroku_fulluser_cache.get(hashable_entity)
-            and not self._heroku_fulluser_cache[hashable_entity].expired
-            and self._heroku_fulluser_cache[hashable_entity].ts + exp > time.time()
+        if not force and (
+            record := self._heroku_fulluser_cache.lookup(
+                hashable_entity,
+                exp,
+                strict=True,
+            )
         ):
-            return self._heroku_fulluser_cache[hashable_entity].full_user
+            return record.full_user
 
         result = await self(GetFullUserRequest(entity))
         self._heroku_fulluser_cache[hashable_entity] = CacheRecordFullUser(
@@ -538,7 +842,7 @@ class CustomTelegramClient(TelegramClient):
     @staticmethod
     def _find_message_obj_in_frame(
         chat_id: int,
-        frame: inspect.FrameInfo,
+        frame: types.FrameType,
     ) -> typing.Optional[Message]:
         """
         Finds the message object from the frame
@@ -547,7 +851,7 @@ class CustomTelegramClient(TelegramClient):
         return next(
             (
                 obj
-                for obj in frame.frame.f_locals.values()
+                for obj in frame.f_locals.values()
                 if isinstance(obj, Message)
                 and getattr(obj.reply_to, "forum_topic", False)
                 and chat_id == getattr(obj.peer_id, "channel_id", None)
@@ -558,31 +862,30 @@ class CustomTelegramClient(TelegramClient):
     async def _find_message_obj_in_stack(
         self,
         chat: EntityLike,
-        stack: typing.List[inspect.FrameInfo],
+        frame: types.FrameType,
     ) -> typing.Optional[Message]:
         """
-        Finds the message object from the stack
+        Finds the message object in the frame and its callers
         """
-        chat_id = (await self.get_entity(chat, exp=0)).id
+        chat_id = (await self.get_entity(chat, exp=0, copy=False)).id
         logger.debug("Finding message object in stack for chat %s", chat_id)
-        return next(
-            (
-                self._find_message_obj_in_frame(chat_id, frame_info)
-                for frame_info in stack
-                if self._find_message_obj_in_frame(chat_id, frame_info)
-            ),
-            None,
-        )
+        while frame is not None:
+            if message := self._find_message_obj_in_frame(chat_id, frame):
+                return message
+
+            frame = frame.f_back
+
+        return None
 
     async def _find_topic_in_stack(
         self,
         chat: EntityLike,
-        stack: typing.List[inspect.FrameInfo],
+        frame: types.FrameType,
     ) -> typing.Optional[Message]:
         """
-        Finds the message object from the stack
+        Finds the message object in the frame and its callers
         """
-        message = await self._find_message_obj_in_stack(chat, stack)
+        message = await self._find_message_obj_in_stack(chat, frame)
         return (
             (message.reply_to.reply_to_top_id or message.reply_to.reply_to_msg_id)
             if message
@@ -592,7 +895,6 @@ class CustomTelegramClient(TelegramClient):
     async def _topic_guesser(
         self,
         native_method: typing.Callable[..., typing.Awaitable[Message]],
-        stack: typing.List[inspect.FrameInfo],
         *args,
         **kwargs,
     ):
@@ -605,7 +907,10 @@ class CustomTelegramClient(TelegramClient):
 
             logger.debug("Topic deleted, trying to guess topic id")
 
-            topic = await self._find_topic_in_stack(args[0], stack)
+            # Callers of `send_message` / `send_file` are still awaiting it, so
+            # they are reachable from the current frame. Stack is inspected only
+            # here, on the rare retry path, and not before each send
+            topic = await self._find_topic_in_stack(args[0], sys._getframe())
 
             logger.debug("Guessed topic id: %s", topic)
 
@@ -614,23 +919,13 @@ class CustomTelegramClient(TelegramClient):
 
             kwargs["reply_to"] = topic
             kwargs["_topic_no_retry"] = True
-            return await self._topic_guesser(native_method, stack, *args, **kwargs)
+            return await self._topic_guesser(native_method, *args, **kwargs)
 
     async def send_file(self, *args, **kwargs) -> Message:
-        return await self._topic_guesser(
-            super().send_file,
-            inspect.stack(),
-            *args,
-            **kwargs,
-        )
+        return await self._topic_guesser(super().send_file, *args, **kwargs)
 
     async def send_message(self, *args, **kwargs) -> Message:
-        return await self._topic_guesser(
-            super().send_message,
-            inspect.stack(),
-            *args,
-            **kwargs,
-        )
+        return await self._topic_guesser(super().send_message, *args, **kwargs)
 
     async def _call(
         self,
@@ -659,27 +954,30 @@ class CustomTelegramClient(TelegramClient):
 
         not_tuple = False
         if not is_list_like(request):
+            if request.CONSTRUCTOR_ID not in self._forbidden_constructors:
+                # Nothing to filter, which is the case for almost every request
+                return await super()._call(
+                    sender,
+                    request,
+                    ordered,
+                    flood_sleep_threshold,
+                )
+
             not_tuple = True
             request = (request,)
 
         new_request = []
+        called_by_module = None
 
         for item in request:
-            if item.CONSTRUCTOR_ID in self._forbidden_constructors and next(
-                (
-                    frame_info.frame.f_locals["self"]
-                    for frame_info in inspect.stack()
-                    if hasattr(frame_info, "frame")
-                    and hasattr(frame_info.frame, "f_locals")
-                    and isinstance(frame_info.frame.f_locals, dict)
-                    and "self" in frame_info.frame.f_locals
-                    and isinstance(frame_info.frame.f_locals["self"], Module)
-                    and not getattr(
-                        frame_info.frame.f_locals["self"], "__origin__", ""
-                    ).startswith("<core")
-                ),
-                None,
-            ):
+            if item.CONSTRUCTOR_ID not in self._forbidden_constructors:
+                new_request += [item]
+                continue
+
+            if called_by_module is None:
+                called_by_module = self._called_by_module()
+
+            if called_by_module:
                 logger.debug(
                     "🎉 I protected you from unintented %s (%s)!",
                     item.__class__.__name__,
@@ -699,9 +997,33 @@ class CustomTelegramClient(TelegramClient):
             flood_sleep_threshold,
         )
 
+    @staticmethod
+    def _called_by_module() -> bool:
+        """Whether request is sent by non-core module"""
+        from . import loader
+
+        if loader._external_context.get():
+            return True
+
+        # Not every entry point of modules sets the context (e.g. `client_ready`
+        # or raw event handlers, added by module itself), so look for the module
+        # in caller frames. Only done for forbidden constructors, which are rare
+        frame = sys._getframe(1)
+        while frame is not None:
+            caller = frame.f_locals.get("self")
+            if isinstance(caller, Module) and not getattr(
+                caller, "__origin__", ""
+            ).startswith("<core"):
+                return True
+
+            frame = frame.f_back
+
+        return False
+
     def _internal_forbid_ctor(self, constructors: list):
-        self._forbidden_constructors.extend(constructors)
-        self._forbidden_constructors = list(set(self._forbidden_constructors))
+        self._forbidden_constructors = self._forbidden_constructors | frozenset(
+            constructors
+        )
 
     def forbid_constructor(self, constructor: int):
         """
@@ -15,6 +15,7 @@ import ast
 import asyncio
 import contextlib
 import copy
+import hashlib
 import importlib
 import importlib.machinery
 import importlib.util
@@ -25,6 +26,7 @@ import re
 import sys
 import time
 import typing
+import weakref
 from dataclasses import dataclass, field
 from importlib.abc import SourceLoader
 
@@ -41,6 +43,8 @@ from herokutl.tl.types import (
 )
 
 from . import version
+from ._bytecode_cache import bytecode_cache
+from ._internal import logs_as_client
 from ._reference_finder import replace_all_refs
 from .inline.types import (
     BotInlineCall,
@@ -282,11 +286,29 @@ def _make_safe_db_proxy():
             "_me",
             "_db_file",
             "_saving_task",
-            "_revisions",
+            "_history",
+            "_revision_dirty",
+            "_restore",
+            "_remember",
+            "_remember_owner",
+            "rollback",
+            "list_revisions",
+            "diff_revision",
+            "flush",
+            "flush_sync",
             "_next_revision_call",
+            "_owner_versions",
+            "_storage",
+            "_dirty",
+            "_compaction_task",
+            "_compact",
+            "_persist",
+            "_storage_failed",
+            "_unloaded",
+            "_load",
             "redis_init",
             "remote_force_save",
-            "_redis_save",
+            "_flush_later",
             "_redis_save_sync",
         }
 
@@ -316,6 +338,21 @@ def _make_safe_db_proxy():
                     _origin_map.get(self, "<unknown>"),
                 )
                 raise AttributeError("Access to db attribute is blocked")
+            if name == "set":
+                db = _db_map[self]
+
+                def set(owner, key, value, **_):
+                    # External modules can't skip validation of written values
+                    return db.set(owner, key, value)
+
+                return set
+            if name == "pointer":
+                db = _db_map[self]
+
+                def pointer(owner, key, default=None, item_type=None, **_):
+                    return db.pointer(owner, key, default, item_type)
+
+                return pointer
             return getattr(_db_map[self], name)
 
         def __setattr__(self, name: str, value):
@@ -544,16 +581,31 @@ class StringLoader(SourceLoader):
     def __init__(self, data: str, origin: str):
         self.data = data.encode("utf-8") if isinstance(data, str) else data
         self.origin = origin
+        # SHA-256 of source, known once code is requested. Same value as
+        # `loader._calc_module_hash`, so it's reused for `__module_hash__`
+        self.source_hash: typing.Optional[str] = None
+        # Seconds, spent in `get_code`, so loader can report compile time
+        # separately from module execution
+        self.compile_time = 0.0
 
     def get_source(self, _=None) -> str:
         return self.data.decode("utf-8")
 
     def get_code(self, fullname: str) -> bytes:
-        return (
-            compile(source, self.origin, "exec", dont_inherit=True)
-            if (source := self.get_data(fullname))
-            else None
-        )
+        started = time.perf_counter()
+        try:
+            if not (source := self.get_data(fullname)):
+                return None
+
+            self.source_hash = hashlib.sha256(source).hexdigest()
+            if code := bytecode_cache.load(self.source_hash, self.origin):
+                return code
+
+            code = compile(source, self.origin, "exec", dont_inherit=True)
+            bytecode_cache.save(self.source_hash, code)
+            return code
+        finally:
+            self.compile_time += time.perf_counter() - started
 
     def get_filename(self, *args, **kwargs) -> str:
         return self.origin
@@ -746,6 +798,7 @@ class Module:
     def heroku_watchers(self, _):
         pass
 
+    @logs_as_client(lambda self: self.client.tg_id)
     async def animate(
         self,
         message: typing.Union[Message, InlineMessage],
@@ -767,9 +820,6 @@ class Module:
         """
         from . import utils
 
-        with contextlib.suppress(AttributeError):
-            _heroku_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         if interval < 0.1:
             logger.warning(
                 "Resetting animation interval to 0.1s, because it may get you in"
@@ -856,7 +906,7 @@ class Module:
         """
         from . import utils
 
-        channel = await self.client.get_entity(peer)
+        channel = await self.client.get_entity(peer, copy=False)
 
         match channel:
             case ChannelForbidden():
@@ -1298,6 +1348,10 @@ class ModuleConfig(dict):
             {option: config.value for option, config in self._config.items()}
         )
 
+        # Lets loader find config of changed value, when saving it
+        for config in self._config.values():
+            config._module_config = self
+
     def getdoc(self, key: str, message: typing.Optional[Message] = None) -> str:
         """Get the documentation by key"""
         ret = self._config[key].doc
@@ -1373,6 +1427,10 @@ class ConfigValue:
     ] = None
     folder: typing.Optional[str] = None
 
+    # Values, changed since they were saved to database, by `id`. Values of
+    # unloaded modules leave the queue, once they are garbage collected
+    _save_queue = weakref.WeakValueDictionary()
+
     def __post_init__(self):
         if isinstance(self.value, _Placeholder):
             self.value = self.default
@@ -1446,8 +1504,8 @@ class ConfigValue:
                         )
                         value = default_val
 
-            # This attribute will tell the `Loader` to save this value in db
-            self._save_marker = True
+            # This will tell the `Loader` to save this value in db
+            ConfigValue._save_queue[id(self)] = self
 
         object.__setattr__(self, key, value)
 
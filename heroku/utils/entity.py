@@ -362,7 +362,7 @@ async def asset_forum_topic(
     icon_emoji_id: typing.Optional[int] = None,
     invite_bot: bool = False,
 ) -> ForumTopic:
-    entity = await client.get_entity(peer)
+    entity = await client.get_entity(peer, copy=False)
 
     if not isinstance(entity, Channel):
         raise TypeError(
@@ -398,7 +398,7 @@ async def asset_forum_topic(
 
         return result.topics[0]
 
-    forums_cache = db.pointer("heroku.forums", "forums_cache", {})
+    forums_cache = db.pointer("heroku.forums", "forums_cache", {}, trusted=True)
 
     async def _search_topic(topic_title: str) -> int | None:
         result = await client(
@@ -558,7 +558,7 @@ async def get_target(message: Message, arg_no: int = 0) -> typing.Optional[int]:
         return None
 
     try:
-        entity = await message.client.get_entity(user)
+        entity = await message.client.get_entity(user, copy=False)
     except ValueError:
         return None
     else:
@@ -6,7 +6,6 @@
 
 import contextlib
 import io
-import json
 import logging
 import re
 import typing
@@ -503,6 +502,58 @@ def censor(
     return obj
 
 
+_JSON_SCALARS = (str, int, float, type(None))
+_JSON_CONTAINERS = (dict, list, tuple)
+# Verdicts for leaf types. Subclasses of scalars are accepted by `json`, so
+# they are checked once and remembered
+_json_scalar_types: typing.Dict[type, bool] = {
+    str: True,
+    int: True,
+    float: True,
+    bool: True,
+    type(None): True,
+}
+
+
+def _is_json_scalar(x: typing.Any, /) -> bool:
+    try:
+        return _json_scalar_types[type(x)]
+    except KeyError:
+        verdict = _json_scalar_types[type(x)] = isinstance(x, _JSON_SCALARS)
+        return verdict
+
+
+def _is_json_value(x: typing.Any, seen: typing.Set[int], /) -> bool:
+    scalars = _json_scalar_types
+    if isinstance(x, dict):
+        if not all(map(_is_json_scalar, x)):
+            return False
+
+        items = x.values()
+    elif isinstance(x, (list, tuple)):
+        items = x
+    else:
+        return _is_json_scalar(x)
+
+    if id(x) in seen:
+        # Circular reference
+        return False
+
+    seen.add(id(x))
+    for item in items:
+        if scalars.get(type(item)):
+            continue
+
+        if isinstance(item, _JSON_CONTAINERS):
+            if not _is_json_value(item, seen):
+                return False
+        elif not _is_json_scalar(item):
+            return False
+
+    seen.discard(id(x))
+    return True
+
+
 def is_serializable(x: typing.Any, /) -> bool:
     """
     Checks if object is JSON-serializable
@@ -510,9 +561,8 @@ def is_serializable(x: typing.Any, /) -> bool:
     :return: True if object is JSON-serializable, False otherwise
     """
     try:
-        json.dumps(x)
-        return True
-    except Exception:
+        return _is_json_value(x, set())
+    except RecursionError:
         return False
 
 